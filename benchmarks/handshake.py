@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.handshake
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Measures session id generation, session creation and handshake
+    throughput.
+
+    Usage::
+
+        python benchmarks/handshake.py [number of handshakes]
+
+    :copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+    :license: Apache, see LICENSE for more details.
+"""
+import sys
+import time
+from hashlib import md5
+from random import random
+
+from tornado.web import Application
+from tornado.httpserver import HTTPRequest
+
+from tornadio2 import SocketConnection, TornadioRouter, sessioncontainer
+from tornadio2.router import HandshakeHandler
+
+
+class Request(object):
+    def __init__(self):
+        self.remote_ip = '127.0.0.1'
+        self.arguments = dict()
+        self.cookies = dict()
+
+
+class Stream(object):
+    def set_close_callback(self, callback):
+        pass
+
+
+class Connection(object):
+    def __init__(self):
+        self.stream = Stream()
+        self.xheaders = False
+
+    def write(self, chunk, callback=None):
+        pass
+
+    def finish(self):
+        pass
+
+
+class IdleConnection(SocketConnection):
+    def on_message(self, message):
+        pass
+
+
+def legacy_key():
+    i = md5()
+    i.update('%s%s' % (random(), time.time()))
+    return i.hexdigest()
+
+
+def measure(name, func, count):
+    start = time.time()
+
+    for _ in xrange(count):
+        func()
+
+    elapsed = time.time() - start
+
+    print '%-28s %10d per second' % (name, count / elapsed)
+
+
+def main(count):
+    generator = sessioncontainer.SessionIdGenerator()
+
+    measure('Legacy md5 session ids:', legacy_key, count)
+    measure('Session ids:', generator.generate, count)
+
+    router = TornadioRouter(IdleConnection)
+    request = Request()
+
+    measure('Sessions:', lambda: router.create_session(request), count)
+
+    application = Application(router.urls)
+    connection = Connection()
+
+    def handshake():
+        http_request = HTTPRequest('GET', '/socket.io/1/',
+                                   remote_ip='127.0.0.1',
+                                   connection=connection)
+
+        handler = HandshakeHandler(application, http_request, server=router)
+        handler._transforms = []
+        handler.get('1')
+
+    measure('Handshakes:', handshake, count)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.heartbeat
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Measures cost of sending heartbeats to idle sessions, with one timer per
+    session and with the shared heartbeat wheel.
+
+    Usage::
+
+        python benchmarks/heartbeat.py [number of sessions]
+
+    :copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+    :license: Apache, see LICENSE for more details.
+"""
+import sys
+import time
+
+from tornado import ioloop
+
+from tornadio2 import SocketConnection, TornadioRouter, periodic, proto
+
+
+class Request(object):
+    def __init__(self):
+        self.remote_ip = '127.0.0.1'
+        self.arguments = dict()
+        self.cookies = dict()
+
+
+class Handler(object):
+    def send_messages(self, messages):
+        pass
+
+    def send_heartbeat(self):
+        pass
+
+
+class IdleConnection(SocketConnection):
+    def on_message(self, message):
+        pass
+
+
+def report(name, count, elapsed):
+    print '%-28s %10d per second' % (name, count / elapsed)
+
+
+def main(count):
+    io_loop = ioloop.IOLoop()
+    router = TornadioRouter(IdleConnection, io_loop=io_loop)
+
+    request = Request()
+    handler = Handler()
+
+    sessions = []
+    for _ in xrange(count):
+        s = router.create_session(request)
+        s.handler = handler
+        sessions.append(s)
+
+    # One timer per session, as before
+    timers = []
+    for s in sessions:
+        callback = lambda s=s: s.send_message(proto.heartbeat())
+        timers.append(periodic.Callback(callback, 12000, io_loop))
+
+    start = time.time()
+    for t in timers:
+        t._running = True
+        t._run()
+    report('Per-session timers:', count, time.time() - start)
+
+    # Heartbeat wheel
+    wheel = router.heartbeats
+    for s in sessions:
+        wheel.add(s)
+
+    start = time.time()
+    for _ in xrange(wheel.ticks):
+        wheel._run()
+    report('Heartbeat wheel:', count, time.time() - start)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
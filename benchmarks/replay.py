@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.replay
+    ~~~~~~~~~~~~~~~~~
+
+    Replays recorded traffic on the local router with an echo connection and
+    reports replay throughput. Recordings are made with
+    ``TornadioRouter.start_recording``.
+
+    Usage::
+
+        python benchmarks/replay.py recording [speed]
+
+    Speed 0 replays packets without recorded delays.
+
+    :copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+    :license: Apache, see LICENSE for more details.
+"""
+import sys
+import time
+
+from tornado import ioloop
+
+from tornadio2 import SocketConnection, TornadioRouter, recorder
+
+
+class EchoConnection(SocketConnection):
+    def on_message(self, message):
+        self.send(message)
+
+    def on_event(self, name, *args, **kwargs):
+        self.emit(name, *args, **kwargs)
+
+    def on_binary(self, data):
+        self.send(data, binary=True)
+
+
+def main(path, speed):
+    io_loop = ioloop.IOLoop()
+    router = TornadioRouter(EchoConnection, io_loop=io_loop)
+
+    replayer = recorder.PacketReplayer(router, path, speed)
+
+    started = time.time()
+    replayer.start(io_loop.stop)
+    io_loop.start()
+    elapsed = time.time() - started
+
+    print 'Replayed packets:   %10d' % replayer.count
+    print 'Elapsed:            %10.2f s' % elapsed
+    print 'Packets per second: %10d' % (replayer.count / max(elapsed, 0.001))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else 1.0)
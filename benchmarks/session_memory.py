@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.session_memory
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures memory used by idle sessions.
+
+    Usage::
+
+        python benchmarks/session_memory.py [number of sessions]
+
+    :copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+    :license: Apache, see LICENSE for more details.
+"""
+import sys
+import gc
+import resource
+
+from tornadio2 import SocketConnection, router, session, stats
+
+
+class Request(object):
+    def __init__(self):
+        self.remote_ip = '127.0.0.1'
+        self.arguments = dict()
+        self.cookies = dict()
+
+
+class Server(object):
+    def __init__(self):
+        self.settings = router.DEFAULT_SETTINGS.copy()
+        self.stats = stats.StatsCollector()
+        self.io_loop = None
+        self.replay_size = 0
+        self.tracer = None
+
+
+class IdleConnection(SocketConnection):
+    def on_message(self, message):
+        pass
+
+
+def rss():
+    """Return maximum resident set size in kilobytes (Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main(count):
+    server = Server()
+    request = Request()
+
+    gc.collect()
+    before = rss()
+
+    sessions = [session.Session(IdleConnection, server, request, 30)
+                for _ in xrange(count)]
+
+    gc.collect()
+    after = rss()
+
+    print 'Sessions:            %d' % len(sessions)
+    print 'Total memory:        %d KB' % (after - before)
+    print 'Memory per session:  %d bytes' % ((after - before) * 1024 / count)
+    print
+    print 'sizeof(Session):          %d' % sys.getsizeof(sessions[0])
+    print 'sizeof(SocketConnection): %d' % sys.getsizeof(sessions[0].conn)
+    print 'sizeof(ConnectionInfo):   %d' % sys.getsizeof(sessions[0].info)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+    tornadio2.tests.handshake_test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+    :license: Apache, see LICENSE for more details.
+"""
+
+from nose.tools import eq_
+
+from tornado import web
+from tornado.testing import AsyncHTTPTestCase
+
+from tornadio2 import router, conn, proto
+
+
+class DummyConnection(conn.SocketConnection):
+    def on_message(self, message):
+        pass
+
+
+class EchoConnection(conn.SocketConnection):
+    def on_message(self, message):
+        self.send(message)
+
+
+class HandshakeTest(AsyncHTTPTestCase):
+    settings = dict(enabled_protocols=['websocket', 'xhr-polling'])
+
+    def get_app(self):
+        self.router = router.TornadioRouter(DummyConnection,
+                                            self.settings,
+                                            io_loop=self.io_loop)
+        return web.Application(self.router.urls)
+
+    def test_handshake(self):
+        response = self.fetch('/socket.io/1/')
+        eq_(response.code, 200)
+
+        session_id, suffix = response.body.split(':', 1)
+        eq_(suffix, '17:25:websocket,xhr-polling')
+        eq_(self.router.get_session(session_id).session_id, session_id)
+
+        # JSONP handshake
+        response = self.fetch('/socket.io/1/?jsonp=2')
+        eq_(response.headers['Content-Type'], 'application/javascript; charset=UTF-8')
+
+        session_id = response.body[len('io.j[2]("'):].split(':', 1)[0]
+        eq_(response.body,
+            'io.j[2](%s);' % proto.json_dumps(session_id + ':17:25:websocket,xhr-polling'))
+
+
+class AdmissionTest(AsyncHTTPTestCase):
+    def get_app(self):
+        self.router = router.TornadioRouter(DummyConnection,
+                                            dict(handshake_rate=0.5,
+                                                 handshake_burst=1),
+                                            io_loop=self.io_loop)
+        return web.Application(self.router.urls)
+
+    def test_rejected(self):
+        eq_(self.fetch('/socket.io/1/').code, 200)
+
+        # Burst is exhausted, next token is available in 2 seconds
+        response = self.fetch('/socket.io/1/')
+        eq_(response.code, 503)
+        eq_(response.headers['Retry-After'], '2')
+        eq_(self.router.stats.handshakes_rejected, 1)
+        eq_(len(self.router._sessions), 1)
+
+    def test_draining(self):
+        self.router.draining = True
+
+        response = self.fetch('/socket.io/1/')
+        eq_(response.code, 503)
+        eq_(response.headers['Retry-After'], '1')
+        eq_(self.router.stats.handshakes_rejected, 1)
+
+
+class InboundLimitsTest(AsyncHTTPTestCase):
+    def get_app(self):
+        self.router = router.TornadioRouter(EchoConnection,
+                                            dict(max_frame_size=1000),
+                                            io_loop=self.io_loop)
+        return web.Application(self.router.urls)
+
+    def test_multiframe_post(self):
+        session_id = self.fetch('/socket.io/1/').body.split(':', 1)[0]
+
+        # Every frame is within the limit
+        packets = [proto.message(None, 'x' * 900) for _ in xrange(3)]
+        response = self.fetch('/socket.io/1/xhr-polling/%s' % session_id,
+                              method='POST',
+                              body=proto.encode_frames(packets))
+        eq_(response.code, 200)
+
+        sess = self.router.get_session(session_id)
+        eq_(sess.is_closed, False)
+        eq_(len(sess.send_queue), 4)
+        eq_(self.router.stats.inbound_limited, 0)
+
+
+class PostLimitsTest(AsyncHTTPTestCase):
+    def get_app(self):
+        self.router = router.TornadioRouter(EchoConnection,
+                                            dict(max_frame_size=100,
+                                                 max_frames_per_post=2,
+                                                 inbound_limit_action='drop'),
+                                            io_loop=self.io_loop)
+        return web.Application(self.router.urls)
+
+    def _post(self, session_id, packets):
+        return self.fetch('/socket.io/1/xhr-polling/%s' % session_id,
+                          method='POST',
+                          body=proto.encode_frames(packets))
+
+    def test_post_limits(self):
+        session_id = self.fetch('/socket.io/1/').body.split(':', 1)[0]
+        sess = self.router.get_session(session_id)
+
+        # Too many packets, every rejected request is counted once
+        response = self._post(session_id, [proto.message(None, 'x')] * 3)
+        eq_(response.code, 200)
+        eq_(self.router.stats.inbound_limited, 1)
+
+        # Body is too large
+        response = self._post(session_id, [proto.message(None, 'x' * 600)])
+        eq_(response.code, 200)
+        eq_(self.router.stats.inbound_limited, 2)
+
+        # Nothing was processed
+        eq_(sess.send_queue, [u'1::'])
+
+        response = self._post(session_id, [proto.message(None, 'x')] * 2)
+        eq_(self.router.stats.inbound_limited, 2)
+        eq_(len(sess.send_queue), 3)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+    tornadio2.tests.heartbeat_test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+    :license: Apache, see LICENSE for more details.
+"""
+
+from nose.tools import eq_
+
+from tornadio2 import heartbeat
+
+
+class DummySession(object):
+    def __init__(self, transport=None):
+        self._transport = transport
+
+        self._heartbeat_slot = None
+        self._heartbeat_due = 0
+
+        self.heartbeats = 0
+        self.callback = None
+
+    def _heartbeat(self):
+        self.heartbeats += 1
+
+        if self.callback is not None:
+            self.callback()
+
+
+def test_wheel():
+    wheel = heartbeat.HeartbeatWheel(3000)
+
+    a = DummySession()
+    b = DummySession()
+
+    wheel.add(a)
+    wheel.add(b)
+
+    wheel._run()
+    wheel._run()
+    wheel.delay(b)
+
+    # Heartbeat is due for the first session only
+    wheel._run()
+    eq_(a.heartbeats, 1)
+    eq_(b.heartbeats, 0)
+
+    # Delayed session is moved, but not lost
+    wheel._run()
+    wheel._run()
+    eq_(b.heartbeats, 1)
+
+    # Stopped session does not get heartbeats
+    wheel.remove(a)
+    for _ in xrange(10):
+        wheel._run()
+
+    eq_(a.heartbeats, 1)
+    eq_(b.heartbeats, 4)
+
+
+def test_removed_by_heartbeat():
+    wheel = heartbeat.HeartbeatWheel(3000)
+
+    sessions = [DummySession() for _ in xrange(3)]
+    for s in sessions:
+        wheel.add(s)
+
+    # Whichever session gets first heartbeat stops others
+    def callback():
+        first = [s for s in sessions if s.heartbeats][0]
+
+        for s in sessions:
+            s.callback = None
+            if s is not first:
+                wheel.remove(s)
+
+    for s in sessions:
+        s.callback = callback
+
+    for _ in xrange(10):
+        wheel._run()
+
+    eq_(sorted(s.heartbeats for s in sessions), [0, 0, 3])
+    eq_(sum(len(slot) for slot in wheel.slots), 1)
+
+
+def test_transport_interval():
+    wheel = heartbeat.HeartbeatWheel(3000,
+                                     transport_intervals={'xhr-polling': 5000})
+
+    eq_(wheel.period(DummySession()), 3)
+    eq_(wheel.period(DummySession('xhr-polling')), 5)
+
+
+def test_stretch():
+    wheel = heartbeat.HeartbeatWheel(3000, max_stretch=2000, load_threshold=100)
+
+    # Ticks are on time
+    now = 100.0
+    for _ in xrange(10):
+        wheel._run(now)
+        now += 1
+
+    eq_(wheel.stretch, 0)
+    eq_(wheel.period(DummySession()), 3)
+
+    # Ticks are late
+    for _ in xrange(10):
+        wheel._run(now)
+        now += 2
+
+    eq_(wheel.stretch, 2)
+    eq_(wheel.period(DummySession()), 5)
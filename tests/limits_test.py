@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+    tornadio2.tests.limits_test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+    :license: Apache, see LICENSE for more details.
+"""
+
+from nose.tools import eq_
+
+from tornadio2 import limits
+
+
+def test_token_bucket():
+    bucket = limits.TokenBucket(2, 4, now=0)
+
+    eq_(bucket.wait_time(), 0)
+
+    bucket.tokens = 0
+    eq_(bucket.wait_time(), 0.5)
+
+    # Half a second is enough for one token
+    bucket.refill(0.5)
+    eq_(bucket.tokens, 1)
+
+    # Bucket never overflows
+    bucket.refill(100)
+    eq_(bucket.tokens, 4)
+
+
+def test_max_sessions():
+    admission = limits.AdmissionControl(max_sessions=10, retry_after=15)
+
+    eq_(admission.admit('127.0.0.1', 9), 0)
+    eq_(admission.admit('127.0.0.1', 10), 15)
+
+
+def test_handshake_rate():
+    admission = limits.AdmissionControl(rate=1, burst=2)
+    admission.bucket.updated = 0
+
+    eq_(admission.admit('127.0.0.1', 0, now=0), 0)
+    eq_(admission.admit('127.0.0.2', 0, now=0), 0)
+    eq_(admission.admit('127.0.0.3', 0, now=0), 1)
+
+    eq_(admission.admit('127.0.0.3', 0, now=1), 0)
+
+
+def test_ip_handshake_rate():
+    admission = limits.AdmissionControl(ip_rate=1, ip_burst=1)
+
+    eq_(admission.admit('127.0.0.1', 0, now=0), 0)
+    eq_(admission.admit('127.0.0.1', 0, now=0.5), 0.5)
+
+    # Other IPs are not affected
+    eq_(admission.admit('127.0.0.2', 0, now=0.5), 0)
+
+    # Full buckets are pruned
+    admission.prune(now=1.2)
+    eq_(admission.ip_buckets.keys(), ['127.0.0.2'])
+
+    admission.prune(now=2)
+    eq_(admission.ip_buckets, dict())
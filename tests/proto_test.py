@@ -7,7 +7,7 @@
     :license: Apache, see LICENSE for more details.
 """
 
-from nose.tools import eq_
+from nose.tools import eq_, ok_, raises
 
 from tornadio2 import proto
 
@@ -47,3 +47,47 @@ def test_message():
 
 
     # TODO: Add event unit tests
+
+
+def test_binary_frame():
+    frame = proto.binary_frame(u'/test', '\x00abc')
+    eq_(frame, '/test\x00\x00abc')
+    eq_(proto.decode_binary_frame(frame), (u'/test', '\x00abc'))
+
+    eq_(proto.binary_message(u'/test', 'abc'), u'4::/test:{"$binary": "YWJj"}')
+
+
+def test_prepared():
+    msg = proto.PreparedMessage({'a': 'b'})
+    packet = msg.packet(u'/test')
+    eq_(packet, proto.message(u'/test', {'a': 'b'}))
+    eq_(packet.utf8, packet.encode('utf-8'))
+    ok_(msg.packet(u'/test') is packet)
+    eq_(msg.packet(None, 12), proto.message(None, {'a': 'b'}, 12))
+
+    evt = proto.PreparedEvent('test', 1, u'ф')
+    eq_(evt.packet(None), proto.event(None, 'test', None, 1, u'ф'))
+    eq_(proto.encode_frames([evt.packet(None)]), evt.packet(None).encode('utf-8'))
+
+
+@raises(ValueError)
+def test_prepared_none():
+    proto.PreparedMessage(None)
+
+
+def test_control_packets():
+    eq_(proto.connect(), u'1::')
+    eq_(proto.connect(u'/test'), u'1::/test')
+    ok_(proto.connect(u'/test') is proto.connect(u'/test'))
+    eq_(proto.disconnect(u'/test'), u'0::/test')
+
+    eq_(proto.error(None, None, proto.ADVICE_RECONNECT), u'7:::+0')
+    eq_(proto.error(u'/test', u'reason'), u'7::/test:reason+')
+
+    # Acknowledgments
+    eq_(proto.ack(None, 1), u'6:::1')
+    eq_(proto.ack(u'/test', 1, True), u'6::/test:1+[true]')
+    eq_(proto.ack(None, 1, 10), u'6:::1+[10]')
+    eq_(proto.ack(None, 1, u'"a"'), u'6:::1+["\\"a\\""]')
+    eq_(proto.ack(None, 1, (1, 'a')), u'6:::1+[1, "a"]')
+    eq_(proto.ack(None, 1, dict(a=1)), u'6:::1+[{"a": 1}]')
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+    tornadio2.tests.recorder_test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+    :license: Apache, see LICENSE for more details.
+"""
+
+import os
+import tempfile
+
+from nose.tools import eq_
+
+from tornado import ioloop
+
+from tornadio2 import router, conn, recorder, trace
+
+
+class EchoConnection(conn.SocketConnection):
+    received = []
+
+    def on_message(self, message):
+        self.received.append(message)
+        self.send(message)
+
+    def on_binary(self, data):
+        self.received.append(data)
+
+
+def _get_router():
+    return router.TornadioRouter(EchoConnection,
+                                 io_loop=ioloop.IOLoop())
+
+
+def test_record_replay():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    os.remove(path)
+
+    try:
+        # Record
+        server = _get_router()
+        server.start_recording(path)
+
+        handler = recorder.ReplayHandler('websocket', '127.0.0.1')
+        sess = server.create_session(handler.request)
+        handler.attach(sess)
+        sess.raw_message(u'3:::тест')
+        sess.binary_message('\x00\x01')
+
+        server.stop_recording()
+        eq_(server.tracer, None)
+
+        records = [r[1:] for r in recorder.read_recording(path)]
+        eq_(records, [
+            (trace.OUTBOUND, sess.session_id, '', u'1::'),
+            (trace.INBOUND, sess.session_id, 'websocket', u'3:::тест'),
+            (trace.OUTBOUND, sess.session_id, 'websocket', u'3:::тест'),
+            (trace.INBOUND, sess.session_id, 'websocket', '\x00\x01'),
+            ])
+
+        # Replay
+        del EchoConnection.received[:]
+
+        server = _get_router()
+        replayer = recorder.PacketReplayer(server, path, speed=0)
+        replayer.start(server.io_loop.stop)
+        server.io_loop.start()
+
+        eq_(replayer.count, 2)
+        eq_(EchoConnection.received, [u'тест', '\x01'])
+    finally:
+        os.remove(path)
+
+
+def test_record_polling():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    os.remove(path)
+
+    try:
+        server = _get_router()
+        server.start_recording(path)
+
+        # Packet is posted while another transport is attached
+        handler = recorder.ReplayHandler('jsonp', '127.0.0.1')
+        sess = server.create_session(handler.request)
+        handler.attach(sess)
+        sess.raw_message(u'3:::abc', 'xhr-polling')
+
+        server.stop_recording()
+
+        records = [r[1:] for r in recorder.read_recording(path)]
+        eq_(records[1], (trace.INBOUND, sess.session_id, 'xhr-polling', u'3:::abc'))
+
+        # Replay
+        server = _get_router()
+        replayer = recorder.PacketReplayer(server, path, speed=0)
+        replayer.start(server.io_loop.stop)
+        server.io_loop.start()
+
+        eq_(replayer.count, 1)
+    finally:
+        os.remove(path)
+
+
+def test_record_error():
+    class FullDisk(object):
+        def write(self, data):
+            raise IOError(28, 'No space left on device')
+
+        def close(self):
+            pass
+
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+
+    try:
+        server = _get_router()
+        rec = server.start_recording(path)
+        rec._file.close()
+        rec._file = FullDisk()
+
+        # Message path is not affected and recording is stopped
+        handler = recorder.ReplayHandler('websocket', '127.0.0.1')
+        sess = server.create_session(handler.request)
+        handler.attach(sess)
+        sess.raw_message(u'3:::abc')
+
+        eq_(sess.is_closed, False)
+        eq_(rec.failed, True)
+        eq_(server.tracer, None)
+        eq_(server.recorder, None)
+    finally:
+        os.remove(path)
+
+
+def test_long_session_id():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+
+    try:
+        server = router.TornadioRouter(EchoConnection,
+                                       dict(session_id_prefix='x' * 300),
+                                       io_loop=ioloop.IOLoop())
+        server.start_recording(path)
+
+        handler = recorder.ReplayHandler('websocket', '127.0.0.1')
+        sess = server.create_session(handler.request)
+
+        server.stop_recording()
+
+        eq_([r[2] for r in recorder.read_recording(path)], [sess.session_id])
+    finally:
+        os.remove(path)
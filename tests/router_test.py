@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+    tornadio2.tests.router_test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+    :license: Apache, see LICENSE for more details.
+"""
+
+import os
+import time
+import tempfile
+import Cookie
+
+from nose.tools import eq_
+
+from tornado import ioloop
+
+from tornadio2 import router, conn
+
+
+class DummyRequest(object):
+    def __init__(self, **kwargs):
+        self.arguments = kwargs
+        self.cookies = dict()
+        self.remote_ip = '127.0.0.1'
+
+
+class DummyConnection(conn.SocketConnection):
+    __snapshot__ = ('user',)
+
+    def on_open(self, info):
+        if getattr(self, 'user', None):
+            self.send('welcome back')
+
+    def on_message(self, message):
+        pass
+
+
+def _get_router(**settings):
+    return router.TornadioRouter(DummyConnection,
+                                 settings,
+                                 io_loop=ioloop.IOLoop())
+
+
+def test_drain():
+    server = _get_router()
+
+    sessions = [server.create_session(DummyRequest()) for _ in xrange(3)]
+
+    drained = []
+    server.drain(window=0.01, batch_size=2,
+                 callback=lambda: drained.append(True))
+
+    # First wave is processed immediately
+    eq_(server.draining, True)
+    closed = [s for s in sessions if s.is_closed]
+    eq_(len(closed), 2)
+
+    # Clients are asked to reconnect
+    eq_(closed[0].send_queue, [u'1::', u'7:::+0', u'0::'])
+
+    # Second wave
+    server.io_loop.add_timeout(time.time() + 0.1, server.io_loop.stop)
+    server.io_loop.start()
+
+    eq_([s.is_closed for s in sessions], [True, True, True])
+    eq_(drained, [True])
+
+
+def test_snapshot():
+    server = _get_router()
+
+    sess = server.create_session(DummyRequest(a=['1']))
+    sess.conn.user = 'joe'
+    sess.conn.send('abc')
+    sess.expiry_date = time.time() + 10
+
+    closed = server.create_session(DummyRequest())
+    closed.close()
+
+    expired = server.create_session(DummyRequest())
+    expired.expiry_date = time.time() - 1
+
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+
+    try:
+        eq_(server.save_snapshot(path), 2)
+
+        # Restore sessions in the new router
+        server = _get_router(session_snapshot=path)
+
+        # Snapshot is consumed
+        eq_(os.path.exists(path), False)
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+    restored = server.get_session(sess.session_id)
+
+    eq_(restored.conn.user, 'joe')
+    eq_(restored.info.get_argument('a'), '1')
+    eq_(restored.send_queue, [u'1::', u'3:::abc', u'3:::welcome back'])
+
+    # Remaining expiry time is preserved
+    eq_(restored.expiry_date - time.time() < 11, True)
+
+    eq_(server.get_session(closed.session_id), None)
+    eq_(server.get_session(expired.session_id), None)
+
+
+class DummyHandler(object):
+    name = 'websocket'
+    request = DummyRequest()
+
+    def __init__(self):
+        self.sent = []
+
+    def send_messages(self, messages):
+        self.sent.extend(messages)
+
+    def session_closed(self):
+        pass
+
+
+def test_resume():
+    server = _get_router(replay_buffer_size=2)
+
+    old = server.create_session(DummyRequest())
+    old.set_handler(DummyHandler())
+    old.flush()
+    old.conn.send('a')
+    old.conn.send('b')
+    old.conn.send('c')
+
+    # Packet 1 is not in the buffer anymore
+    sess = server.create_session(DummyRequest(resume=[old.session_id],
+                                              seq=['0']))
+    eq_(sess.info.resumed, False)
+    eq_(old.is_closed, False)
+
+    # Client received first two packets
+    sess = server.create_session(DummyRequest(resume=[old.session_id],
+                                              seq=['2']))
+    eq_(sess.info.resumed, True)
+    eq_(sess.send_queue, [u'1::', u'3:::c'])
+    eq_(old.is_closed, True)
+    eq_(server.get_session(old.session_id), None)
+
+
+def test_resume_pending():
+    server = _get_router(replay_buffer_size=10)
+
+    old = server.create_session(DummyRequest())
+    handler = DummyHandler()
+    old.set_handler(handler)
+    old.flush()
+    old.conn.send('a')
+    old.remove_handler(handler)
+
+    # Bulk packet is delivered after the regular one, so it gets next number
+    old.conn.send('big', bulk=True)
+    old.conn.send('regular')
+    old.set_handler(handler)
+    old.flush()
+    eq_(handler.sent, [u'1::', u'3:::a', u'3:::regular', u'3:::big'])
+    old.remove_handler(handler)
+
+    old.conn.send('d')
+
+    # Client received 'a' and 'regular', lost 'big' and not sent 'd'
+    sess = server.create_session(DummyRequest(resume=[old.session_id],
+                                              seq=['2']))
+    eq_(sess.info.resumed, True)
+    eq_(sess.send_queue, [u'1::', u'3:::big', u'3:::d'])
+
+    # Client can't claim packets that were not sent
+    old = sess
+    sess = server.create_session(DummyRequest(resume=[old.session_id],
+                                              seq=['1']))
+    eq_(sess.info.resumed, False)
+
+
+def test_connection_whitelist():
+    server = _get_router(connection_arguments=['a'],
+                         connection_cookies=['sid'])
+
+    request = DummyRequest(a=['1'], b=['2'])
+    request.cookies = Cookie.SimpleCookie('sid=abc; other=def')
+
+    info = server.create_session(request).info
+    eq_(info.arguments, dict(a=('1',)))
+    eq_(info.get_argument('a'), '1')
+    eq_(info.get_argument('b'), None)
+    eq_(info.cookies.keys(), ['sid'])
+    eq_(info.get_cookie('sid').value, 'abc')
+    eq_(info.get_cookie('other'), None)
+
+
+def test_resume_after_coalesce():
+    server = _get_router(replay_buffer_size=10)
+
+    old = server.create_session(DummyRequest())
+    old.conn.send_keyed('p', 1)
+    old.conn.send_keyed('p', 2)
+    old.conn.send('x')
+
+    # Client receives only two data packets
+    handler = DummyHandler()
+    old.set_handler(handler)
+    old.flush()
+    eq_(handler.sent, [u'1::', u'4:::2', u'3:::x'])
+
+    sess = server.create_session(DummyRequest(resume=[old.session_id],
+                                              seq=['1']))
+    eq_(sess.info.resumed, True)
+    eq_(sess.send_queue, [u'1::', u'3:::x'])
+
+
+def test_transport_heartbeat_interval():
+    server = _get_router(transport_heartbeat_intervals={'jsonp-polling': 5,
+                                                        'unknown': 5})
+    eq_(server.heartbeats.transport_ticks, {'jsonp': 5})
+
+    # Heartbeat is rescheduled when transport attaches
+    sess = server.create_session(DummyRequest())
+    sess.reset_heartbeat()
+    eq_(sess._heartbeat_due, server.heartbeats.tick + 12)
+
+    handler = DummyHandler()
+    handler.name = 'jsonp'
+    sess.set_handler(handler)
+    eq_(sess._heartbeat_due, server.heartbeats.tick + 5)
+
+    # Interval is kept between polls
+    sess.remove_handler(handler)
+    server.heartbeats._run()
+    eq_(server.heartbeats.period(sess), 5)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+    tornadio2.tests.schema_test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+    :license: Apache, see LICENSE for more details.
+"""
+
+from nose.tools import eq_, raises
+
+from tornadio2.schema import compile_schema, Optional
+
+
+def test_schema():
+    validate = compile_schema({'id': (int, long),
+                               'name': basestring,
+                               'points': [{'x': float, 'y': float}],
+                               'note': Optional(lambda v: len(v) < 5)})
+
+    eq_(validate({'id': 1, 'name': u'a', 'points': []}), True)
+    eq_(validate({'id': 1, 'name': u'a', 'points': [{'x': 1.0, 'y': 2.0}],
+                  'note': 'abc'}), True)
+
+    eq_(validate([]), False)
+    eq_(validate({'id': 1, 'name': u'a'}), False)
+    eq_(validate({'id': 1, 'name': u'a', 'points': [{'x': 1.0}]}), False)
+    eq_(validate({'id': 1, 'name': u'a', 'points': [], 'note': 'abcdef'}), False)
+
+
+@raises(ValueError)
+def test_invalid_schema():
+    compile_schema([int, int])
@@ -2,7 +2,7 @@ from collections import deque
 
 from nose.tools import eq_, raises
 
-from tornadio2 import session, proto, conn, stats
+from tornadio2 import session, proto, conn, stats, limits, heartbeat, trace
 
 from simplejson import JSONDecodeError
 
@@ -27,6 +27,10 @@ class DummyServer(object):
                 verify_remote_ip=True,
         )
         self.stats = stats.StatsCollector()
+        self.inbound_limits = None
+        self.replay_size = 0
+        self.tracer = None
+        self.heartbeats = heartbeat.HeartbeatWheel(12000)
 
     def create_session(self, handler):
         return session.Session(self._connection,
@@ -36,6 +40,8 @@ class DummyServer(object):
 
 
 class DummyTransport(object):
+    name = 'dummy'
+
     def __init__(self, session, request):
         self.session = session
         self.request = request
@@ -43,15 +49,24 @@ class DummyTransport(object):
         self.outgoing = deque()
         self.is_open = True
 
+        # Detach after sending, like polling transports do
+        self.detach = False
+
     def send_messages(self, messages):
         self.outgoing.extend(messages)
 
+        if self.detach:
+            self.session.remove_handler(self)
+
     def session_closed(self):
         self.is_open = False
 
     # Manipulation
     def recv(self, message):
-        self.session.raw_message(message)
+        if isinstance(message, proto.BinaryFrame):
+            self.session.binary_message(message)
+        else:
+            self.session.raw_message(message)
 
     def pop_outgoing(self):
         return self.outgoing.popleft()
@@ -334,3 +349,338 @@ def test_ack():
     # Check outgoing
     eq_(transport.pop_outgoing(), proto.event(None, 'test', None, a=10, b=20))
     eq_(transport.pop_outgoing(), proto.ack(None, 1, 'test'))
+
+
+def test_profiler():
+    # Create environment
+    server, session, transport, conn = _get_test_environment()
+
+    profiler = server.stats.profiler
+    profiler.enabled = True
+
+    # Send event, it will be echoed back
+    transport.recv(proto.event(None, 'test', None, a=10, b=20))
+
+    breakdown = profiler.dump()
+    eq_(breakdown['parse']['calls'], 1)
+    eq_(breakdown['dispatch']['calls'], 1)
+    eq_(breakdown['encode']['calls'], 1)
+    eq_(breakdown['write']['calls'], 1)
+
+    # Disabled profiler does not collect anything
+    profiler.enabled = False
+
+    transport.recv(proto.message(None, 'abc'))
+    eq_(profiler.dump()['parse']['calls'], 1)
+
+
+def test_inbound_limits():
+    # Create environment
+    server, session, transport, conn = _get_test_environment()
+
+    server.inbound_limits = limits.InboundLimits(max_frame_size=10,
+                                                 packets_ps=2,
+                                                 action='drop')
+
+    # Oversized packet is dropped before it is parsed
+    transport.recv(proto.message(None, 'a' * 20))
+    eq_(len(conn.incoming), 0)
+
+    # Rate limit
+    transport.recv(proto.message(None, 'abc'))
+    transport.recv(proto.message(None, 'def'))
+    transport.recv(proto.message(None, 'ghi'))
+    eq_(len(conn.incoming), 2)
+
+    eq_(server.stats.inbound_limited, 2)
+    eq_(session.is_closed, False)
+
+    # Session is closed if limit is exceeded
+    server.inbound_limits.action = 'close'
+    transport.recv(proto.message(None, 'a' * 20))
+    eq_(session.is_closed, True)
+
+
+def test_keyed():
+    # Create environment
+    server, session, transport, conn = _get_test_environment()
+
+    # Detach transport, so messages are queued
+    session.remove_handler(transport)
+
+    conn.send_keyed('price', 1)
+    conn.send('abc')
+    conn.send_keyed('price', 2)
+    conn.emit_keyed('pos', 'pos', 10)
+    conn.emit_keyed('pos', 'pos', 20)
+
+    eq_(session.send_queue, [proto.message(None, 2),
+                             proto.message(None, 'abc'),
+                             proto.event(None, 'pos', None, 20)])
+    eq_(server.stats.packets_coalesced, 2)
+
+    # Keys are forgotten after flush
+    session.set_handler(transport)
+    session.flush()
+    eq_(len(transport.outgoing), 3)
+
+    session.remove_handler(transport)
+    conn.send_keyed('price', 3)
+    eq_(session.send_queue, [proto.message(None, 3)])
+
+
+def test_priority_lanes():
+    # Create environment
+    server, session, transport, conn = _get_test_environment()
+
+    session.remove_handler(transport)
+
+    conn.send('a' * 10, bulk=True)
+    conn.emit_bulk('b', 'b' * 10)
+    conn.send('abc')
+    session._heartbeat()
+
+    eq_(session.get_pending(), [proto.heartbeat(),
+                                proto.message(None, 'abc'),
+                                proto.message(None, 'a' * 10),
+                                proto.event(None, 'b', None, 'b' * 10)])
+
+    # Only one bulk packet fits into the response
+    transport.bulk_budget = 20
+    transport.detach = True
+    session.set_handler(transport)
+    session.flush()
+
+    eq_(list(transport.outgoing), [proto.heartbeat(),
+                                   proto.message(None, 'abc'),
+                                   proto.message(None, 'a' * 10)])
+    eq_(session.get_pending(), [proto.event(None, 'b', None, 'b' * 10)])
+
+
+def test_disconnect_after_bulk():
+    # Create environment
+    server, session, transport, conn = _get_test_environment()
+
+    session.remove_handler(transport)
+
+    conn.send('big', bulk=True)
+    session.send_message(proto.error(None, None, proto.ADVICE_RECONNECT))
+    session.close()
+
+    eq_(session.get_pending(), [proto.message(None, 'big'),
+                                proto.error(None, None, proto.ADVICE_RECONNECT),
+                                proto.disconnect()])
+
+
+def test_response_budget():
+    # Create environment
+    server, session, transport, conn = _get_test_environment()
+
+    session.remove_handler(transport)
+
+    for i in xrange(5):
+        conn.send_keyed(i, 'a' * 10)
+
+    # Packet is 14 characters long, so only two of them fit
+    transport.response_budget = 30
+    transport.detach = True
+    session.set_handler(transport)
+    session.flush()
+
+    eq_(len(transport.outgoing), 2)
+    eq_(len(session.send_queue), 3)
+
+    # Keyed packets are still coalesced
+    conn.send_keyed(4, 'b')
+    eq_(session.send_queue[2], proto.message(None, 'b'))
+
+    # Packet larger than the budget is still sent
+    transport.response_budget = 1
+    session.set_handler(transport)
+    session.flush()
+
+    eq_(len(transport.outgoing), 3)
+    eq_(len(session.send_queue), 2)
+
+
+def test_adaptive_heartbeats():
+    # Create environment
+    server, session, transport, conn = _get_test_environment()
+
+    wheel = server.heartbeats
+    wheel.adaptive = True
+
+    session.reset_heartbeat()
+    wheel._run()
+
+    # Outgoing traffic postpones heartbeat
+    conn.send('abc')
+    for _ in xrange(wheel.ticks - 1):
+        wheel._run()
+    eq_(session._missed_heartbeats, 0)
+
+    wheel._run()
+    eq_(session._missed_heartbeats, 1)
+
+    # Any incoming packet resets missed heartbeats
+    transport.recv(proto.message(None, 'abc'))
+    eq_(session._missed_heartbeats, 0)
+
+
+def test_event_spec():
+    class SpecConnection(conn.SocketConnection):
+        @conn.event
+        def test(self, a, b=None):
+            pass
+
+        @conn.event
+        def any(self, a, *args, **kwargs):
+            pass
+
+    spec = SpecConnection._events['test']
+    eq_(spec.check([1], None), None)
+    eq_(spec.check([1, 2], None), None)
+    eq_(spec.check([], dict(a=1)), None)
+    eq_(spec.check([1, 2, 3], None), 'expected at most 2 arguments, got 3')
+    eq_(spec.check([], dict(b=1)), 'missing argument a')
+    eq_(spec.check([], dict(a=1, c=2)), 'unexpected argument c')
+
+    spec = SpecConnection._events['any']
+    eq_(spec.check([1, 2, 3], None), None)
+    eq_(spec.check([], dict(a=1, c=2)), None)
+
+
+def test_event_handler_error():
+    class FailingConnection(conn.SocketConnection):
+        @conn.event
+        def test(self, a):
+            raise TypeError('handler')
+
+    # Create environment
+    server, session, transport, conn_ = _get_test_environment(FailingConnection)
+
+    # Handler exception is not mistaken for invalid arguments
+    try:
+        transport.recv(proto.event(None, 'test', None, a=10))
+    except TypeError, ex:
+        eq_(str(ex), 'handler')
+    else:
+        raise AssertionError('TypeError was not raised')
+
+
+def test_event_schema():
+    from tornadio2.schema import Optional
+
+    class SchemaConnection(conn.SocketConnection):
+        def __init__(self, session, endpoint=None):
+            super(SchemaConnection, self).__init__(session, endpoint)
+            self.moves = []
+
+        @conn.event('move', schema={'x': int, 'y': int,
+                                    'tags': Optional([basestring])})
+        def move(self, x, y, tags=None):
+            self.moves.append((x, y))
+
+    # Create environment
+    server, session, transport, conn_ = _get_test_environment(SchemaConnection)
+
+    transport.recv(proto.event(None, 'move', None, x=1, y=2, tags=['a']))
+    transport.recv('5:::{"name":"move","args":[3,4]}')
+    eq_(conn_.moves, [(1, 2), (3, 4)])
+
+    # Invalid payloads are dropped
+    transport.recv(proto.event(None, 'move', None, x=1, y='2'))
+    transport.recv(proto.event(None, 'move', None, x=1, y=2, tags=[1]))
+    transport.recv('5:::{"name":"move","args":[3,"a"]}')
+    eq_(len(conn_.moves), 2)
+    eq_(server.stats.events_rejected, 3)
+
+
+def test_binary():
+    class BinaryConnection(DummyConnection):
+        def on_binary(self, data):
+            self.incoming.append(data)
+            self.send(data, binary=True)
+
+    # Create environment
+    server, session, transport, conn = _get_test_environment(BinaryConnection)
+
+    # Fallback for transports without binary frames support
+    transport.recv(proto.binary_frame(None, '\x00\xff'))
+    eq_(conn.incoming.popleft(), '\x00\xff')
+    eq_(transport.pop_outgoing(), u'4:::{"$binary": "AP8="}')
+
+    # Binary frame
+    transport.binary = True
+    transport.session.binary_message(proto.binary_frame(None, '\x00\xff'))
+
+    frame = transport.pop_outgoing()
+    eq_(type(frame), proto.BinaryFrame)
+    eq_(proto.decode_binary_frame(frame), (None, '\x00\xff'))
+
+
+def test_prepared():
+    # Create environment
+    server, session, transport, conn = _get_test_environment()
+
+    msg = proto.PreparedMessage('abc')
+    conn.send(msg)
+    eq_(transport.pop_outgoing(), u'3:::abc')
+
+    conn.emit(proto.PreparedEvent('test', 1))
+    eq_(transport.pop_outgoing(), u'5:::{"args": [1], "name": "test"}')
+
+    # Prepared message with acknowledgment
+    conn.send(msg, lambda *args: None)
+    eq_(transport.pop_outgoing(), u'3:1::abc')
+
+
+def test_tracing():
+    # Create environment
+    server, session, transport, conn = _get_test_environment()
+
+    traced = []
+    server.tracer = trace.PacketTracer(sink=lambda s, d, p, t: traced.append((d, p)))
+
+    transport.recv(proto.message(None, 'abc'))
+    eq_(traced, [(trace.INBOUND, u'3:::abc'), (trace.OUTBOUND, u'3:::abc')])
+
+    # Sampling
+    del traced[:]
+    server.tracer = trace.PacketTracer(sample=2, sink=lambda s, d, p, t: traced.append(p))
+
+    for n in xrange(4):
+        conn.send(str(n))
+    eq_(traced, [u'3:::1', u'3:::3'])
+
+    # Session filter
+    del traced[:]
+    server.tracer = trace.PacketTracer(sessions=['other'], sink=lambda s, d, p, t: traced.append(p))
+
+    conn.send('abc')
+    eq_(traced, [])
+
+    # Heartbeats written directly by the transport are traced too
+    transport.send_heartbeat = lambda: None
+    server.tracer = trace.PacketTracer(sink=lambda s, d, p, t: traced.append((d, p, t)))
+
+    session._heartbeat()
+    eq_(traced, [(trace.OUTBOUND, proto.heartbeat(), 'dummy')])
+
+
+def test_watchdog_processing():
+    class ProcessingConnection(DummyConnection):
+        def on_message(self, message):
+            self.incoming.append(self.session.server.stats.processing)
+
+    # Create environment
+    server, session, transport, conn = _get_test_environment(ProcessingConnection)
+
+    # Processed packet is not tracked without watchdog
+    transport.recv(proto.message(None, 'abc'))
+    eq_(conn.incoming.popleft(), None)
+
+    server.stats.watchdog = object()
+    transport.recv(proto.message(None, 'abc'))
+    eq_(conn.incoming.popleft(), (session.session_id, '', proto.MESSAGE))
+    eq_(server.stats.processing, None)
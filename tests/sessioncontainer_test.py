@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+    tornadio2.tests.sessioncontainer_test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+    :license: Apache, see LICENSE for more details.
+"""
+
+from nose.tools import eq_, raises
+
+from tornadio2 import sessioncontainer
+
+
+def test_session_ids():
+    generator = sessioncontainer.SessionIdGenerator(batch_size=4)
+
+    ids = set(generator.generate() for _ in xrange(100))
+    eq_(len(ids), 100)
+
+    for session_id in ids:
+        eq_(len(session_id), 32)
+        int(session_id, 16)
+
+
+def test_session_id_prefix():
+    generator = sessioncontainer.SessionIdGenerator('w1-')
+
+    session_id = generator.generate()
+    eq_(session_id[:3], 'w1-')
+    eq_(len(session_id), 35)
+
+
+@raises(ValueError)
+def test_invalid_session_id_prefix():
+    sessioncontainer.SessionIdGenerator('w1/')
+
+
+def test_expire():
+    container = sessioncontainer.SessionContainer()
+
+    first = sessioncontainer.SessionBase(expiry=10)
+    second = sessioncontainer.SessionBase(expiry=20)
+
+    container.add(first)
+    container.add(second)
+
+    eq_(container.get(first.session_id), first)
+
+    # Promoted session is rescheduled
+    second.promoted = first.expiry_date + 100
+
+    container.expire(second.expiry_date + 1)
+
+    eq_(container.get(first.session_id), None)
+    eq_(container.get(second.session_id), second)
+
+
+def test_sharded_expire():
+    container = sessioncontainer.ShardedSessionContainer(4)
+
+    sessions = [sessioncontainer.SessionBase(expiry=10) for _ in xrange(20)]
+    for s in sessions:
+        container.add(s)
+
+    eq_(len(container), 20)
+    eq_(container.get(sessions[0].session_id), sessions[0])
+
+    # One shard is swept per call
+    expire_time = max(s.expiry_date for s in sessions) + 1
+    first_shard = len(container.shards[0])
+
+    container.expire(expire_time)
+    eq_(len(container.shards[0]), 0)
+    eq_(len(container), 20 - first_shard)
+
+    for _ in xrange(3):
+        container.expire(expire_time)
+
+    eq_(len(container), 0)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+    tornadio2.tests.sqlitestore_test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+    :license: Apache, see LICENSE for more details.
+"""
+
+import os
+import time
+import sqlite3
+import tempfile
+
+from nose.tools import eq_
+
+from tornadio2 import sessioncontainer, sqlitestore
+
+
+def test_ownership():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+
+    try:
+        first = sqlitestore.SQLiteSessionStore(path, 'first')
+        second = sqlitestore.SQLiteSessionStore(path, 'second')
+
+        s = sessioncontainer.SessionBase(expiry=30)
+        first.add(s)
+
+        eq_(first.get(s.session_id), s)
+        eq_(first.owner(s.session_id), 'first')
+
+        # Updates are written lazily
+        eq_(second.owner(s.session_id), None)
+
+        first.expire()
+        eq_(second.get(s.session_id), None)
+        eq_(second.owner(s.session_id), 'first')
+
+        # Removal
+        first.remove(s.session_id)
+        first.flush()
+        eq_(second.owner(s.session_id), None)
+
+        first.close()
+        second.close()
+    finally:
+        os.remove(path)
+
+
+def test_attached_session():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+
+    try:
+        first = sqlitestore.SQLiteSessionStore(path, 'first')
+        second = sqlitestore.SQLiteSessionStore(path, 'second')
+
+        attached = sessioncontainer.SessionBase(expiry=30)
+        idle = sessioncontainer.SessionBase(expiry=30)
+        first.add(attached)
+        first.add(idle)
+
+        now = time.time()
+        first.flush(now)
+
+        # Session is never touched, but attached transport keeps it alive
+        now += 100
+        attached.promoted = now + 30
+        first.expire(now)
+
+        eq_(first.get(attached.session_id), attached)
+        eq_(second.owner(attached.session_id, now), 'first')
+
+        # Expired session row is removed
+        eq_(first.get(idle.session_id), None)
+        eq_(second.owner(idle.session_id, now - 100), None)
+
+        first.close()
+        second.close()
+    finally:
+        os.remove(path)
+
+
+def _row_expires(path, session_id):
+    db = sqlite3.connect(path)
+    try:
+        return db.execute('SELECT expires FROM sessions WHERE id = ?',
+                          (session_id,)).fetchone()[0]
+    finally:
+        db.close()
+
+
+def test_dirty_flush():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+
+    try:
+        store = sqlitestore.SQLiteSessionStore(path, 'first')
+
+        touched = sessioncontainer.SessionBase(expiry=30)
+        untouched = sessioncontainer.SessionBase(expiry=30)
+        store.add(touched)
+        store.add(untouched)
+
+        now = time.time()
+        store.flush(now)
+        written = _row_expires(path, untouched.session_id)
+
+        # Only touched session is written
+        store.touch(touched)
+        store.flush(now + 5)
+        eq_(_row_expires(path, untouched.session_id), written)
+        eq_(_row_expires(path, touched.session_id) > written, True)
+
+        store.close()
+    finally:
+        os.remove(path)
+
+
+def test_locked_database():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+
+    try:
+        store = sqlitestore.SQLiteSessionStore(path, 'first', timeout=0.01)
+        other = sqlitestore.SQLiteSessionStore(path, 'second')
+
+        s = sessioncontainer.SessionBase(expiry=30)
+        store.add(s)
+
+        lock = sqlite3.connect(path)
+        lock.execute('BEGIN EXCLUSIVE')
+
+        # Flush does not wait for the lock
+        started = time.time()
+        store.flush()
+        eq_(time.time() - started < 1, True)
+
+        lock.rollback()
+        lock.close()
+
+        eq_(other.owner(s.session_id), None)
+
+        # Update is written on the next flush
+        store.flush()
+        eq_(other.owner(s.session_id), 'first')
+
+        store.close()
+        other.close()
+    finally:
+        os.remove(path)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+    tornadio2.tests.stats_test
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+    :license: Apache, see LICENSE for more details.
+"""
+
+from nose.tools import eq_
+
+from tornadio2 import stats
+
+
+class DummyIOLoop(object):
+    def __init__(self):
+        self.timeouts = []
+
+    def add_timeout(self, deadline, callback):
+        self.timeouts.append((deadline, callback))
+
+
+def _get_watchdog():
+    collector = stats.StatsCollector()
+
+    watchdog = stats.LoopWatchdog(collector, interval=500, threshold=1000)
+    watchdog.io_loop = DummyIOLoop()
+    watchdog._running = True
+    watchdog._last_tick = 100.0
+    watchdog._schedule(100.0)
+
+    return collector, watchdog
+
+
+def test_loop_lag():
+    collector, watchdog = _get_watchdog()
+
+    # Timeout fired 200ms late
+    watchdog._tick(100.7)
+
+    eq_(int(round(watchdog.max_lag)), 200)
+    eq_(int(round(collector.dump()['max_loop_lag'])), 0)
+
+    collector.watchdog = watchdog
+    eq_(int(round(collector.dump()['max_loop_lag'])), 200)
+
+    # Next timeout is scheduled relative to the last run
+    eq_(watchdog.io_loop.timeouts[-1][0], 101.2)
+
+
+def test_blocked_callback():
+    collector, watchdog = _get_watchdog()
+
+    # Not blocked yet
+    eq_(watchdog._check(101.0), None)
+
+    # Blocked while processing an event
+    collector.processing = ('abc', '/test', 'ping')
+
+    incident = watchdog._check(102.0)
+    eq_(incident['session_id'], 'abc')
+    eq_(incident['endpoint'], '/test')
+    eq_(incident['event'], 'ping')
+    eq_(watchdog.blocked_callbacks, 1)
+
+    # Same blocking callback is reported only once
+    eq_(watchdog._check(102.5), None)
+
+    # Loop is back, duration is updated
+    watchdog._tick(103.0)
+    eq_(int(round(incident['duration'])), 2500)
+    eq_(list(watchdog.incidents), [incident])
+
+
+def test_profiler():
+    profiler = stats.StageProfiler()
+
+    eq_(profiler.enabled, False)
+    eq_(profiler.dump()['parse'], dict(calls=0, total=0, average=0))
+
+    profiler.add('parse', 0)
+    profiler.add('parse', 0)
+
+    eq_(profiler.dump()['parse']['calls'], 2)
+    eq_(profiler.dump()['dispatch']['calls'], 0)
+
+    profiler.reset()
+    eq_(profiler.dump()['parse']['calls'], 0)
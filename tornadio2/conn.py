@@ -22,15 +22,16 @@
 """
 import time
 import logging
-from inspect import ismethod, getmembers
+from inspect import ismethod, getmembers, getargspec
 
 from tornadio2 import proto
+from tornadio2.schema import compile_arguments
 
 
 logger = logging.getLogger('tornadio2.conn')
 
 
-def event(name_or_func):
+def event(name_or_func=None, schema=None):
     """Event handler decorator.
 
     Can be used with event name or will automatically use function name
@@ -45,6 +46,14 @@ def event(name_or_func):
         @event
         def baz(self):
             pass
+
+    Optional `schema` is a dictionary of argument schemas by argument name
+    (see ``tornadio2.schema``). Events with arguments that do not match the
+    schema are dropped before handler is called::
+
+        @event('move', schema={'x': int, 'y': int, 'label': Optional(basestring)})
+        def move(self, x, y, label=None):
+            pass
     """
 
     if callable(name_or_func):
@@ -52,18 +61,90 @@ def event(name_or_func):
         return name_or_func
 
     def handler(f):
-        f._event_name = name_or_func
+        f._event_name = name_or_func or f.__name__
+        f._event_schema = schema
         return f
 
     return handler
 
 
+class EventSpec(object):
+    """Precompiled event handler.
+
+    Handler signature is inspected once, when connection class is created,
+    so arguments can be checked before handler is called.
+    """
+    __slots__ = ('handler', 'name', 'arg_names', 'required', 'max_args',
+                 'any_kwargs', 'validator')
+
+    def __init__(self, handler, name):
+        """Constructor.
+
+        `handler`
+            Event handler
+        `name`
+            Event name
+        """
+        self.handler = handler
+        self.name = name
+
+        try:
+            args, varargs, varkw, defaults = getargspec(handler)
+        except TypeError:
+            # Not a Python function, do not check arguments
+            args, varargs, varkw, defaults = ['self'], True, True, None
+
+        # Skip `self`
+        self.arg_names = frozenset(args[1:])
+        self.required = args[1:len(args) - len(defaults or ())]
+        self.max_args = None if varargs else len(args) - 1
+        self.any_kwargs = bool(varkw)
+
+        # Payload validator
+        self.validator = None
+
+        schema = getattr(handler, '_event_schema', None)
+        if schema is not None:
+            self.validator = compile_arguments(schema, args[1:])
+
+    def __call__(self, conn, *args, **kwargs):
+        return self.handler(conn, *args, **kwargs)
+
+    def check(self, args, kwargs):
+        """Return error message if handler can not be called with passed
+        arguments or None otherwise.
+
+        `args`
+            Event args
+        `kwargs`
+            Event kwargs
+        """
+        if args:
+            if len(args) < len(self.required):
+                return 'expected at least %d arguments, got %d' % (len(self.required), len(args))
+
+            if self.max_args is not None and len(args) > self.max_args:
+                return 'expected at most %d arguments, got %d' % (self.max_args, len(args))
+        else:
+            for name in self.required:
+                if name not in kwargs:
+                    return 'missing argument %s' % name
+
+            if not self.any_kwargs:
+                for name in kwargs:
+                    if name not in self.arg_names:
+                        return 'unexpected argument %s' % name
+
+        return None
+
+
 class EventMagicMeta(type):
     """Event handler metaclass"""
     def __init__(cls, name, bases, attrs):
         # find events, also in bases
         is_event = lambda x: ismethod(x) and hasattr(x, '_event_name')
-        events = [(e._event_name, e) for _, e in getmembers(cls, is_event)]
+        events = [(e._event_name, EventSpec(e.im_func, e._event_name))
+                  for _, e in getmembers(cls, is_event)]
         setattr(cls, '_events', dict(events))
 
         # Call base
@@ -95,11 +176,27 @@ class SocketConnection(object):
 
         sock.emit('test', {msg:'Hello World'});
 
+    To preserve connection state when sessions are saved to the snapshot and restored
+    after restart, list state attributes in the `__snapshot__` class level variable::
+
+        class MyConnection(SocketConnection):
+            __snapshot__ = ('user_id', 'room')
+
+    Attribute values should be serializable by the snapshot serializer.
+
+    ``SocketConnection`` uses ``__slots__`` to reduce memory footprint. Your subclasses
+    can still store arbitrary attributes, unless they declare ``__slots__`` as well.
+
     """
     __metaclass__ = EventMagicMeta
 
+    __slots__ = ('session', 'endpoint', 'is_closed', 'ack_id', 'ack_queue',
+                 '_call_queue')
+
     __endpoints__ = dict()
 
+    __snapshot__ = ()
+
     def __init__(self, session, endpoint=None):
         """Connection constructor.
 
@@ -115,9 +212,7 @@ class SocketConnection(object):
         self.is_closed = False
 
         self.ack_id = 1
-        self.ack_queue = dict()
-
-        self._event_worker = None
+        self.ack_queue = None
 
     # Public API
     def on_open(self, request):
@@ -190,33 +285,46 @@ class SocketConnection(object):
         handler = self._events.get(name)
 
         if handler:
-            try:
-                if args:
-                    return handler(self, *args)
-                else:
-                    return handler(self, **kwargs)
-            except TypeError:
-                if args:
-                    logger.error(('Attempted to call event handler %s ' +
-                                  'with %s arguments.') % (handler,
-                                                           repr(args)))
-                else:
-                    logger.error(('Attempted to call event handler %s ' +
-                                  'with %s arguments.') % (handler,
-                                                           repr(kwargs)))
-                raise
+            # Check arguments before calling handler, so exceptions raised
+            # by the handler are not mistaken for invalid arguments.
+            error = handler.check(args, kwargs)
+            if error is not None:
+                logger.error('Attempted to call event handler %s with %s arguments: %s' %
+                             (handler.handler, repr(args or kwargs), error))
+                raise TypeError('Invalid arguments for event %s: %s' % (name, error))
+
+            if handler.validator is not None and not handler.validator(args, kwargs):
+                logger.warning('Rejected event %s with invalid payload' % name)
+                self.session.server.stats.on_event_rejected()
+                return None
+
+            if args:
+                return handler.handler(self, *args)
+            else:
+                return handler.handler(self, **kwargs)
         else:
             logger.error('Invalid event name: %s' % name)
 
+    def on_binary(self, data):
+        """Default binary message handler. Called when client sends binary
+        websocket frame and `websocket_binary` setting is enabled.
+
+        `data`
+            Binary data
+        """
+        logger.error('Binary message is not supported by the connection')
+
     def on_close(self):
         """Default on_close handler."""
         pass
 
-    def send(self, message, callback=None, force_json=False):
+    def send(self, message, callback=None, force_json=False, bulk=False,
+             binary=False):
         """Send message to the client.
 
         `message`
-            Message to send.
+            Message to send. Can be ``proto.PreparedMessage``, which is
+            encoded only once when sent to many clients.
         `callback`
             Optional callback. If passed, callback will be called
             when client received sent message and sent acknowledgment
@@ -225,22 +333,44 @@ class SocketConnection(object):
             Optional argument. If set to True (and message is a string)
             then the message type will be JSON (Type 4 in socket_io protocol).
             This is what you want, when you send already json encoded strings.
+        `bulk`
+            Optional argument. If set to True, message will be queued in the
+            bulk lane: it will be sent after all other messages and polling
+            transports will limit amount of bulk data in one response.
+        `binary`
+            Optional argument. If set to True, message should be a byte string.
+            It will be sent as binary websocket frame if `websocket_binary`
+            setting is enabled and client is connected with websocket.
+            Otherwise, or if `callback` is passed, it will be sent as JSON
+            message with base64 encoded data: ``{"$binary": "..."}``.
         """
         if self.is_closed:
             return
 
-        if callback is not None:
-            msg = proto.message(self.endpoint,
-                                message,
-                                self.queue_ack(callback, message), force_json)
+        if binary:
+            self._send_packet(self._binary_packet, (message, callback), bulk=bulk)
         else:
-            msg = proto.message(self.endpoint, message, force_json=force_json)
-
-        self.session.send_message(msg)
+            self._send_packet(self._message_packet,
+                              (message, callback, force_json),
+                              bulk=bulk)
 
     def emit(self, name, *args, **kwargs):
         """Send socket.io event.
 
+        `name`
+            Name of the event or ``proto.PreparedEvent``. Event arguments are
+            ignored for prepared events.
+        `kwargs`
+            Optional event parameters
+        """
+        if self.is_closed:
+            return
+
+        self._send_packet(self._event_packet, (name, None, args, kwargs))
+
+    def emit_bulk(self, name, *args, **kwargs):
+        """Send socket.io event in the bulk lane. See ``send`` for details.
+
         `name`
             Name of the event
         `kwargs`
@@ -249,8 +379,8 @@ class SocketConnection(object):
         if self.is_closed:
             return
 
-        msg = proto.event(self.endpoint, name, None, *args, **kwargs)
-        self.session.send_message(msg)
+        self._send_packet(self._event_packet, (name, None, args, kwargs),
+                          bulk=True)
 
     def emit_ack(self, callback, name, *args, **kwargs):
         """Send socket.io event with acknowledgment.
@@ -265,12 +395,89 @@ class SocketConnection(object):
         if self.is_closed:
             return
 
-        msg = proto.event(self.endpoint,
-                          name,
-                          self.queue_ack(callback, (name, args, kwargs)),
-                          *args,
-                          **kwargs)
-        self.session.send_message(msg)
+        self._send_packet(self._event_packet, (name, callback, args, kwargs))
+
+    def send_keyed(self, key, message, force_json=False):
+        """Send keyed state update to the client.
+
+        If previous update with the same key was not delivered to the
+        client yet, it will be replaced with the new one, so slow clients
+        receive only the latest value. Replaced update keeps its position
+        in the send queue.
+
+        `key`
+            Update key, for example name of the changed object. Keys are
+            scoped by the endpoint.
+        `message`
+            Message to send.
+        `force_json`
+            Optional argument. Same as in ``send``.
+        """
+        if self.is_closed:
+            return
+
+        self._send_packet(self._message_packet, (message, None, force_json),
+                          (self.endpoint, key))
+
+    def emit_keyed(self, key, name, *args, **kwargs):
+        """Send keyed socket.io event. See ``send_keyed`` for details.
+
+        `key`
+            Update key
+        `name`
+            Name of the event
+        `kwargs`
+            Optional event parameters
+        """
+        if self.is_closed:
+            return
+
+        self._send_packet(self._event_packet, (name, None, args, kwargs),
+                          (self.endpoint, key))
+
+    def _send_packet(self, encode, args, key=None, bulk=False):
+        """Encode packet with `encode` function and queue it. Encoding time
+        is added to the ``encode`` stage when profiling is enabled.
+        """
+        profiler = self.session.server.stats.profiler
+        if profiler.enabled:
+            started = time.time()
+            msg = encode(*args)
+            profiler.add('encode', started)
+        else:
+            msg = encode(*args)
+
+        self.session.send_message(msg, key, bulk)
+
+    def _message_packet(self, message, callback, force_json):
+        message_id = None
+        if callback is not None:
+            message_id = self.queue_ack(callback, message)
+
+        if isinstance(message, proto.PreparedMessage):
+            return message.packet(self.endpoint, message_id)
+
+        return proto.message(self.endpoint, message, message_id, force_json)
+
+    def _event_packet(self, name, callback, args, kwargs):
+        message_id = None
+        if callback is not None:
+            message_id = self.queue_ack(callback, (name, args, kwargs))
+
+        if isinstance(name, proto.PreparedEvent):
+            return name.packet(self.endpoint, message_id)
+
+        return proto.event(self.endpoint, name, message_id, *args, **kwargs)
+
+    def _binary_packet(self, data, callback):
+        if callback is not None:
+            return proto.binary_message(self.endpoint, data,
+                                        self.queue_ack(callback, data))
+
+        if getattr(self.session.handler, 'binary', False):
+            return proto.binary_frame(self.endpoint, data)
+
+        return proto.binary_message(self.endpoint, data)
 
     def close(self):
         """Forcibly close client connection"""
@@ -278,11 +485,41 @@ class SocketConnection(object):
 
         # TODO: Notify about unconfirmed messages?
 
+    # State
+    def get_state(self):
+        """Return connection state to be saved in the snapshot.
+
+        By default, returns dictionary with attributes listed in the
+        `__snapshot__` class level variable.
+        """
+        state = dict()
+
+        for name in self.__snapshot__:
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+
+        return state
+
+    def set_state(self, state):
+        """Restore connection state from the snapshot.
+
+        Called before `on_open` when session is restored.
+
+        `state`
+            State returned by the `get_state`
+        """
+        for name in self.__snapshot__:
+            if name in state:
+                setattr(self, name, state[name])
+
     # ACKS
     def queue_ack(self, callback, message):
         """Queue acknowledgment callback"""
         ack_id = self.ack_id
 
+        if self.ack_queue is None:
+            self.ack_queue = dict()
+
         self.ack_queue[ack_id] = (time.time(),
                                   callback,
                                   message)
@@ -293,7 +530,7 @@ class SocketConnection(object):
 
     def deque_ack(self, msg_id, ack_data):
         """Dequeue acknowledgment callback"""
-        if msg_id in self.ack_queue:
+        if self.ack_queue and msg_id in self.ack_queue:
             time_stamp, callback, message = self.ack_queue.pop(msg_id)
 
             callback(message, ack_data)
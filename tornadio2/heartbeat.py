@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+    tornadio2.heartbeat
+    ~~~~~~~~~~~~~~~~~~~
+
+    Heartbeat scheduler shared by all sessions.
+"""
+import math
+import time
+import logging
+
+from tornado import ioloop
+
+
+logger = logging.getLogger('tornadio2.heartbeat')
+
+
+class HeartbeatWheel(object):
+    """Timing wheel which sends heartbeats for all sessions due in the same
+    tick from one IOLoop callback.
+
+    Wheel has one slot per tick. Scheduled session is stored in the slot
+    where its heartbeat is due, slot index and due tick are stored in the
+    `_heartbeat_slot` and `_heartbeat_due` attributes of the session.
+    Delaying heartbeat only updates due tick, session is moved to the new slot
+    when wheel reaches its old slot.
+
+    Heartbeat interval can be overridden per transport and can be stretched
+    when wheel ticks are late, which means that IOLoop is overloaded.
+    """
+    def __init__(self,
+                 interval,
+                 io_loop=None,
+                 resolution=1000,
+                 transport_intervals=None,
+                 max_stretch=0,
+                 load_threshold=500,
+                 adaptive=False):
+        """Constructor.
+
+        `interval`
+            Heartbeat interval, in milliseconds
+        `io_loop`
+            IOLoop instance
+        `resolution`
+            Tick length, in milliseconds
+        `transport_intervals`
+            Optional dictionary of heartbeat intervals (in milliseconds) by
+            transport handler name. Transport of the session is stored in its
+            `_transport` attribute.
+        `max_stretch`
+            Maximum interval increase under load, in milliseconds
+        `load_threshold`
+            Average tick lateness, in milliseconds, after which intervals are
+            stretched
+        `adaptive`
+            If set, sessions delay their heartbeats when they send or receive
+            packets
+        """
+        self.interval = interval
+        self.resolution = resolution
+        self.adaptive = adaptive
+
+        self.ticks = self._to_ticks(interval)
+
+        self.transport_ticks = dict((name, self._to_ticks(value))
+                                    for name, value in (transport_intervals or dict()).iteritems())
+
+        self.max_stretch = int(max_stretch // resolution)
+        self.load_threshold = load_threshold / 1000.0
+        self.stretch = 0
+
+        # Average tick lateness, in seconds
+        self.lag = 0
+        self._last_run = None
+
+        longest = max([self.ticks] + self.transport_ticks.values())
+        self.slots = [set() for _ in xrange(longest + self.max_stretch + 1)]
+        self.tick = 0
+
+        self._timer = ioloop.PeriodicCallback(self._run, resolution, io_loop)
+
+    def _to_ticks(self, interval):
+        return max(1, int(math.ceil(float(interval) / self.resolution)))
+
+    def period(self, session):
+        """Return heartbeat period of the session, in ticks.
+
+        `session`
+            Session object
+        """
+        ticks = self.ticks
+
+        if self.transport_ticks:
+            ticks = self.transport_ticks.get(session._transport, ticks)
+
+        return ticks + self.stretch
+
+    def start(self):
+        """Start the wheel"""
+        self._timer.start()
+
+    def stop(self):
+        """Stop the wheel"""
+        self._timer.stop()
+
+    def add(self, session):
+        """Schedule session heartbeat after one interval.
+
+        `session`
+            Session object
+        """
+        self.remove(session)
+        self._schedule(session, self.tick + self.period(session))
+
+    def remove(self, session):
+        """Stop session heartbeats.
+
+        `session`
+            Session object
+        """
+        slot = session._heartbeat_slot
+        if slot is not None:
+            self.slots[slot].discard(session)
+            session._heartbeat_slot = None
+
+    def delay(self, session):
+        """Postpone session heartbeat for one interval.
+
+        `session`
+            Session object
+        """
+        if session._heartbeat_slot is not None:
+            session._heartbeat_due = self.tick + self.period(session)
+
+    def _schedule(self, session, due):
+        slot = due % len(self.slots)
+        self.slots[slot].add(session)
+        session._heartbeat_slot = slot
+        session._heartbeat_due = due
+
+    def _update_load(self, now):
+        if self._last_run is not None:
+            late = max(0, now - self._last_run - self.resolution / 1000.0)
+            self.lag = self.lag * 0.9 + late * 0.1
+
+        self._last_run = now
+
+        if self.lag > self.load_threshold:
+            self.stretch = self.max_stretch
+        else:
+            self.stretch = 0
+
+    def _run(self, now=None):
+        if self.max_stretch:
+            self._update_load(now if now is not None else time.time())
+
+        self.tick += 1
+        tick = self.tick
+
+        pos = tick % len(self.slots)
+        sessions = self.slots[pos]
+        if not sessions:
+            return
+
+        self.slots[pos] = set()
+
+        due = []
+        for s in sessions:
+            if s._heartbeat_due > tick:
+                # Heartbeat was delayed, move to the new slot
+                self._schedule(s, s._heartbeat_due)
+            else:
+                due.append(s)
+
+        for s in due:
+            # Heartbeat callback of another session could stop (for example,
+            # by closing the session), reschedule or delay this one
+            if s._heartbeat_slot != pos:
+                continue
+
+            if s._heartbeat_due > tick:
+                self._schedule(s, s._heartbeat_due)
+                continue
+
+            # Reschedule first, so heartbeat callback can stop heartbeats
+            self._schedule(s, tick + self.period(s))
+
+            try:
+                s._heartbeat()
+            except Exception:
+                logger.error('Failed to send heartbeat', exc_info=True)
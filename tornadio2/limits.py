@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+    tornadio2.limits
+    ~~~~~~~~~~~~~~~~
+
+    Admission control and inbound traffic limits.
+"""
+import logging
+from time import time
+
+
+logger = logging.getLogger('tornadio2.limits')
+
+
+class TokenBucket(object):
+    """Token bucket rate limiter"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst=None, now=None):
+        """Constructor.
+
+        `rate`
+            Number of tokens added per second
+        `burst`
+            Bucket size. Defaulted to `rate`.
+        `now`
+            Optional current time (can be used in unit tests)
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.updated = now if now is not None else time()
+
+    def refill(self, now):
+        """Add tokens accumulated since last update"""
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Return number of seconds till next token is available"""
+        if self.tokens >= 1:
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionControl(object):
+    """Handshake admission control.
+
+    Limits total number of sessions, global handshake rate and per-IP
+    handshake rate. Per-IP buckets are stored in a table, which is
+    periodically pruned from the buckets that are full again.
+    """
+    def __init__(self,
+                 max_sessions=0,
+                 rate=0,
+                 burst=0,
+                 ip_rate=0,
+                 ip_burst=0,
+                 retry_after=15,
+                 prune_interval=60):
+        """Constructor. Limits set to 0 are disabled.
+
+        `max_sessions`
+            Maximum number of concurrent sessions
+        `rate`
+            Global handshake rate, per second
+        `burst`
+            Global handshake burst size
+        `ip_rate`
+            Per-IP handshake rate, per second
+        `ip_burst`
+            Per-IP handshake burst size
+        `retry_after`
+            Number of seconds client should wait when session limit is reached
+        `prune_interval`
+            Per-IP table pruning interval, in seconds
+        """
+        self.max_sessions = max_sessions
+        self.retry_after = retry_after
+
+        self.bucket = None
+        if rate:
+            self.bucket = TokenBucket(rate, burst)
+
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst or ip_rate
+        self.ip_buckets = dict()
+
+        self.prune_interval = prune_interval
+        self._next_prune = time() + prune_interval
+
+    def admit(self, ip, active_sessions, now=None):
+        """Check if new session can be created. Returns 0 if handshake was
+        admitted or number of seconds client should wait before retrying.
+
+        `ip`
+            Remote IP address
+        `active_sessions`
+            Number of currently active sessions
+        `now`
+            Optional current time (can be used in unit tests)
+        """
+        if self.max_sessions and active_sessions >= self.max_sessions:
+            return self.retry_after
+
+        if now is None:
+            now = time()
+
+        if now >= self._next_prune:
+            self.prune(now)
+
+        bucket = self.bucket
+        if bucket is not None:
+            bucket.refill(now)
+
+            wait = bucket.wait_time()
+            if wait:
+                return wait
+
+        if self.ip_rate:
+            ip_bucket = self.ip_buckets.get(ip)
+            if ip_bucket is None:
+                ip_bucket = TokenBucket(self.ip_rate, self.ip_burst, now)
+                self.ip_buckets[ip] = ip_bucket
+            else:
+                ip_bucket.refill(now)
+
+            wait = ip_bucket.wait_time()
+            if wait:
+                return wait
+
+            ip_bucket.tokens -= 1
+
+        if bucket is not None:
+            bucket.tokens -= 1
+
+        return 0
+
+    def prune(self, now=None):
+        """Remove per-IP buckets which are full again.
+
+        `now`
+            Optional current time (can be used in unit tests)
+        """
+        if now is None:
+            now = time()
+
+        full = [ip for ip, bucket in self.ip_buckets.iteritems()
+                if bucket.tokens + (now - bucket.updated) * bucket.rate >= bucket.burst]
+
+        for ip in full:
+            del self.ip_buckets[ip]
+
+        self._next_prune = now + self.prune_interval
+
+
+class InboundLimits(object):
+    """Per-session inbound traffic limits.
+
+    Rates are calculated in fixed one second windows. Window state is stored
+    in the session, so sessions without incoming traffic do not use any
+    additional memory.
+    """
+    def __init__(self,
+                 max_frame_size=0,
+                 max_frames_per_post=0,
+                 packets_ps=0,
+                 bytes_ps=0,
+                 action='close'):
+        """Constructor. Limits set to 0 are disabled.
+
+        `max_frame_size`
+            Maximum size of the single packet, in characters
+        `max_frames_per_post`
+            Maximum number of packets in one polling POST request
+        `packets_ps`
+            Maximum number of packets per second
+        `bytes_ps`
+            Maximum number of characters per second
+        `action`
+            What to do when limit is exceeded: 'close' will close the session,
+            'drop' will ignore excessive packets.
+        """
+        if action not in ('close', 'drop'):
+            raise ValueError('Invalid inbound limit action: %s' % action)
+
+        self.max_frame_size = max_frame_size
+        self.max_frames_per_post = max_frames_per_post
+        self.packets_ps = packets_ps
+        self.bytes_ps = bytes_ps
+        self.action = action
+
+        # POST body is checked before it is decoded, so leave some room for
+        # frame separators and JSON escaping of the JSONP transport. Body size
+        # is only limited when both frame size and number of frames are.
+        self.max_post_size = 0
+        if max_frame_size and max_frames_per_post:
+            self.max_post_size = 2 * (max_frame_size + 16) * max_frames_per_post
+
+    def accept_post(self, session, size):
+        """Check size of the polling POST request before it is decoded.
+        Returns False if request should be ignored.
+
+        `session`
+            Session object
+        `size`
+            POST body size
+        """
+        if self.max_post_size and size > self.max_post_size:
+            return self._reject(session, 'POST size %d' % size)
+
+        return True
+
+    def accept_frames(self, session, frames):
+        """Check number of packets in the decoded polling POST request.
+        Returns False if request should be ignored.
+
+        `session`
+            Session object
+        `frames`
+            Number of packets in request
+        """
+        if self.max_frames_per_post and frames > self.max_frames_per_post:
+            return self._reject(session, '%d packets in POST' % frames)
+
+        return True
+
+    def accept(self, session, packet, now=None):
+        """Check incoming packet. Returns False if packet should be ignored.
+
+        `session`
+            Session object
+        `packet`
+            Raw socket.io packet
+        `now`
+            Optional current time (can be used in unit tests)
+        """
+        size = len(packet)
+
+        if self.max_frame_size and size > self.max_frame_size:
+            return self._reject(session, 'packet size %d' % size)
+
+        if not self.packets_ps and not self.bytes_ps:
+            return True
+
+        if now is None:
+            now = time()
+
+        window = session._inbound
+        if window is None or now - window[0] >= 1:
+            window = session._inbound = [now, 0, 0]
+
+        window[1] += 1
+        window[2] += size
+
+        if self.packets_ps and window[1] > self.packets_ps:
+            return self._reject(session, '%d packets per second' % window[1])
+
+        if self.bytes_ps and window[2] > self.bytes_ps:
+            return self._reject(session, '%d bytes per second' % window[2])
+
+        return True
+
+    def _reject(self, session, reason):
+        session.server.stats.on_inbound_limited()
+
+        if self.action == 'close':
+            if not session.is_closed:
+                logger.warning('Closing session %s: inbound limit exceeded (%s)' %
+                               (session.session_id, reason))
+                session.close()
+
+        return False
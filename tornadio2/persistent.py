@@ -27,6 +27,7 @@ import traceback
 import tornado
 from tornado.web import HTTPError
 from tornado import stack_context
+from tornado import websocket
 from tornado.websocket import WebSocketHandler
 
 from tornadio2 import proto
@@ -35,12 +36,32 @@ from tornadio2 import proto
 logger = logging.getLogger('tornadio2.persistent')
 
 
+# Pre-encoded heartbeat frames for known websocket protocol versions
+HEARTBEAT_FRAMES = dict()
+
+if hasattr(websocket, 'WebSocketProtocol13'):
+    HEARTBEAT_FRAMES[websocket.WebSocketProtocol13] = '\x81\x03' + proto.heartbeat().encode('utf-8')
+
+if hasattr(websocket, 'WebSocketProtocol76'):
+    HEARTBEAT_FRAMES[websocket.WebSocketProtocol76] = '\x00' + proto.heartbeat().encode('utf-8') + '\xff'
+
+# Websocket protocol versions with binary frames support
+BINARY_PROTOCOLS = ()
+
+if hasattr(websocket, 'WebSocketProtocol13'):
+    BINARY_PROTOCOLS = (websocket.WebSocketProtocol13,)
+
+
 class TornadioWebSocketHandler(WebSocketHandler):
     """Websocket protocol handler"""
 
     # Transport name
     name = 'websocket'
 
+    # Can client receive binary frames
+    supports_binary = True
+    binary = False
+
     def initialize(self, server):
         self.server = server
         self.session = None
@@ -48,8 +69,6 @@ class TornadioWebSocketHandler(WebSocketHandler):
         self._is_active = not self.server.settings['websocket_check']
         self._global_heartbeats = self.server.settings['global_heartbeats']
 
-        logger.debug('Initializing %s handler.' % self.name)
-
     # Additional verification of the websocket handshake
     # For now it will stay here, till https://github.com/facebook/tornado/pull/415
     # is merged.
@@ -90,6 +109,10 @@ class TornadioWebSocketHandler(WebSocketHandler):
         if self.session is None:
             raise HTTPError(401, "Invalid Session")
 
+        self.binary = (self.supports_binary and
+                       self.server.settings['websocket_binary'] and
+                       isinstance(self.ws_connection, BINARY_PROTOCOLS))
+
         if not self._is_active:
             # Need to check if websocket connection was really established by sending hearbeat packet
             # and waiting for response
@@ -143,7 +166,13 @@ class TornadioWebSocketHandler(WebSocketHandler):
             self.session.delay_heartbeat()
 
         try:
-            self.session.raw_message(message)
+            # Text frames are decoded by Tornado, binary frames are not
+            if isinstance(message, unicode):
+                self.session.raw_message(message, self.name)
+            elif self.binary:
+                self.session.binary_message(message, self.name)
+            else:
+                logger.error('Unexpected binary frame')
         except Exception, ex:
             logger.error('Failed to handle message: ' + traceback.format_exc(ex))
 
@@ -160,13 +189,35 @@ class TornadioWebSocketHandler(WebSocketHandler):
 
         try:
             for m in messages:
-                self.write_message(m)
+                packet_type = type(m)
+                if packet_type is proto.PreparedPacket:
+                    self.write_message(m.utf8)
+                elif packet_type is proto.BinaryFrame:
+                    self.write_message(m, binary=True)
+                else:
+                    self.write_message(m)
         except IOError:
             if self.ws_connection and self.ws_connection.client_terminated:
                 logger.debug('Dropping active websocket connection due to IOError.')
 
             self._detach()
 
+    def send_heartbeat(self):
+        """Send heartbeat packet, bypassing session queue"""
+        # Tracking
+        self.server.stats.on_packet_sent(1)
+
+        ws = self.ws_connection
+        frame = HEARTBEAT_FRAMES.get(type(ws))
+
+        try:
+            if frame is not None:
+                ws.stream.write(frame)
+            else:
+                self.write_message(proto.heartbeat())
+        except IOError:
+            self._detach()
+
     def session_closed(self):
         try:
             self.close()
@@ -191,3 +242,5 @@ class TornadioWebSocketHandler(WebSocketHandler):
 class TornadioFlashSocketHandler(TornadioWebSocketHandler):
     # Transport name
     name = 'flashsocket'
+
+    supports_binary = False
@@ -38,7 +38,9 @@ class TornadioPollingHandlerBase(preflight.PreflightHandler):
         self.server = server
         self.session = None
 
-        logger.debug('Initializing %s transport.' % self.name)
+        # Maximum size of all and bulk packets sent in one response
+        self.response_budget = server.settings['max_response_size'] or None
+        self.bulk_budget = server.settings['bulk_budget'] or None
 
     def _get_session(self, session_id):
         """Get session if exists and checks if session is closed.
@@ -51,7 +53,7 @@ class TornadioPollingHandlerBase(preflight.PreflightHandler):
             raise HTTPError(401, 'Invalid session')
 
         # If session is closed, but there are some pending messages left - make sure to send them
-        if session.is_closed and not session.send_queue:
+        if session.is_closed and not session.has_pending:
             raise HTTPError(401, 'Invalid session')
 
         return session
@@ -84,6 +86,13 @@ class TornadioPollingHandlerBase(preflight.PreflightHandler):
             if self.session.is_closed or not self.preflight():
                 raise HTTPError(401)
 
+            limits = self.server.inbound_limits
+            if limits is not None and not limits.accept_post(self.session,
+                                                             len(self.request.body)):
+                self.set_header('Content-Type', 'text/plain; charset=UTF-8')
+                self.finish()
+                return
+
             # Grab body and decode it (socket.io always sends data in utf-8)
             data = self.request.body.decode('utf-8')
 
@@ -97,9 +106,13 @@ class TornadioPollingHandlerBase(preflight.PreflightHandler):
             # Tracking
             self.server.stats.on_packet_recv(len(packets))
 
+            if limits is not None and not limits.accept_frames(self.session,
+                                                               len(packets)):
+                packets = []
+
             for p in packets:
                 try:
-                    self.session.raw_message(p)
+                    self.session.raw_message(p, self.name)
                 except Exception:
                     # Close session if something went wrong
                     self.session.close()
@@ -148,7 +161,7 @@ class TornadioXHRPollingHandler(TornadioPollingHandlerBase):
             # TODO: Error logging
             raise HTTPError(401)
 
-        if not self.session.send_queue:
+        if not self.session.has_pending:
             self._bump_timeout()
         else:
             self.session.flush()
@@ -297,6 +310,13 @@ class TornadioJSONPHandler(TornadioXHRPollingHandler):
             # Grab data
             data = urllib.unquote_plus(data[2:]).decode('utf-8')
 
+            # Check size before decoding JSON
+            limits = self.server.inbound_limits
+            if limits is not None and not limits.accept_post(self.session, len(data)):
+                self.set_header('Content-Type', 'text/plain; charset=UTF-8')
+                self.finish()
+                return
+
             # If starts with double quote, it is json encoded (socket.io workaround)
             if data.startswith(u'"'):
                 data = proto.json_load(data)
@@ -307,9 +327,13 @@ class TornadioJSONPHandler(TornadioXHRPollingHandler):
             # Tracking
             self.server.stats.on_packet_recv(len(packets))
 
+            if limits is not None and not limits.accept_frames(self.session,
+                                                               len(packets)):
+                packets = []
+
             for p in packets:
                 try:
-                    self.session.raw_message(p)
+                    self.session.raw_message(p, self.name)
                 except Exception:
                     # Close session if something went wrong
                     self.session.close()
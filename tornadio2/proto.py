@@ -20,6 +20,7 @@
 
     Socket.IO protocol related functions
 """
+import base64
 import logging
 
 
@@ -51,9 +52,47 @@ ACK = '6'
 ERROR = '7'
 NOOP = '8'
 
+# Error advices, as indexes in the socket.io client advice list
+ADVICE_RECONNECT = '0'
+
 # socket.io frame separator
 FRAME_SEPARATOR = u'\ufffd'
 
+# Constant control packets
+DISCONNECT_PACKET = u'0::'
+CONNECT_PACKET = u'1::'
+HEARTBEAT_PACKET = u'2::'
+NOOP_PACKET = u'8::'
+
+# Maximum number of cached packets of one type
+PACKET_CACHE_SIZE = 256
+
+
+class _PacketCache(dict):
+    """Cache of control packets by their arguments.
+
+    Cache is cleared when it reaches its size, so random endpoint names or
+    error reasons won't grow it without bounds.
+    """
+    def __init__(self, template, size=PACKET_CACHE_SIZE):
+        super(_PacketCache, self).__init__()
+
+        self.template = template
+        self.size = size
+
+    def __missing__(self, key):
+        if len(self) >= self.size:
+            self.clear()
+
+        packet = self.template % key
+        self[key] = packet
+        return packet
+
+
+_disconnect_packets = _PacketCache(u'0::%s')
+_connect_packets = _PacketCache(u'1::%s')
+_error_packets = _PacketCache(u'7::%s:%s+%s')
+
 
 def disconnect(endpoint=None):
     """Generate disconnect packet.
@@ -61,9 +100,10 @@ def disconnect(endpoint=None):
     `endpoint`
         Optional endpoint name
     """
-    return u'0::%s' % (
-        endpoint or ''
-        )
+    if endpoint:
+        return _disconnect_packets[endpoint]
+
+    return DISCONNECT_PACKET
 
 
 def connect(endpoint=None):
@@ -72,15 +112,16 @@ def connect(endpoint=None):
     `endpoint`
         Optional endpoint name
     """
-    return u'1::%s' % (
-        endpoint or ''
-        )
+    if endpoint:
+        return _connect_packets[endpoint]
+
+    return CONNECT_PACKET
 
 
 def heartbeat():
     """Generate heartbeat message.
     """
-    return u'2::'
+    return HEARTBEAT_PACKET
 
 
 def message(endpoint, msg, message_id=None, force_json=False):
@@ -119,6 +160,50 @@ def message(endpoint, msg, message_id=None, force_json=False):
     return packed_message_tpl % packed_data
 
 
+class BinaryFrame(str):
+    """Binary websocket frame payload. Marks packets which should be sent
+    as binary websocket frames.
+    """
+
+
+def binary_frame(endpoint, data):
+    """Generate binary websocket frame payload.
+
+    Payload consists of the utf-8 encoded endpoint name, zero byte and data.
+
+    `endpoint`
+        Optional endpoint name
+    `data`
+        Binary data
+    """
+    return BinaryFrame((endpoint or u'').encode('utf-8') + '\x00' + data)
+
+
+def decode_binary_frame(frame):
+    """Decode binary websocket frame payload. Returns tuple of endpoint name
+    and data.
+
+    `frame`
+        Frame payload
+    """
+    endpoint, data = frame.split('\x00', 1)
+    return endpoint.decode('utf-8') or None, data
+
+
+def binary_message(endpoint, data, message_id=None):
+    """Generate JSON packet with base64 encoded binary data, used for
+    transports without binary frames support.
+
+    `endpoint`
+        Optional endpoint name
+    `data`
+        Binary data
+    `message_id`
+        Optional message id for ACK
+    """
+    return message(endpoint, {'$binary': base64.b64encode(data)}, message_id)
+
+
 def event(endpoint, name, message_id, *args, **kwargs):
     """Generate event message.
 
@@ -154,6 +239,73 @@ def event(endpoint, name, message_id, *args, **kwargs):
     )
 
 
+class PreparedPacket(unicode):
+    """Encoded packet with cached utf-8 representation"""
+    __slots__ = ('utf8',)
+
+
+class PreparedMessage(object):
+    """Message which is encoded once and can be sent many times.
+
+    Pass it to ``SocketConnection.send`` instead of the message. Packet and
+    its utf-8 representation are cached for every endpoint.
+    """
+    def __init__(self, msg, force_json=False):
+        """Constructor.
+
+        `msg`
+            Message, same as for ``message``
+        `force_json`
+            Same as for ``message``
+        """
+        if msg is None:
+            raise ValueError('Prepared message can not be None')
+
+        self.kind, self.data = _split_packet(message(None, msg, force_json=force_json))
+        self._packets = dict()
+
+    def packet(self, endpoint, message_id=None):
+        """Return packet for the endpoint.
+
+        `endpoint`
+            Optional endpoint name
+        `message_id`
+            Optional message id for ACK. Packets with message id are not cached.
+        """
+        if message_id is not None:
+            return u'%s:%s:%s:%s' % (self.kind, message_id, endpoint or u'', self.data)
+
+        packet = self._packets.get(endpoint)
+        if packet is None:
+            packet = PreparedPacket(u'%s::%s:%s' % (self.kind, endpoint or u'', self.data))
+            packet.utf8 = packet.encode('utf-8')
+            self._packets[endpoint] = packet
+
+        return packet
+
+
+class PreparedEvent(PreparedMessage):
+    """Event which is encoded once and can be sent many times.
+
+    Pass it to ``SocketConnection.emit`` instead of the event name.
+    """
+    def __init__(self, name, *args, **kwargs):
+        """Constructor.
+
+        `name`
+            Event name
+        `args`, `kwargs`
+            Event arguments, same as for ``event``
+        """
+        self.kind, self.data = _split_packet(event(None, name, None, *args, **kwargs))
+        self._packets = dict()
+
+
+def _split_packet(packet):
+    """Split packet without message id and endpoint into type and data"""
+    return packet[0], packet[4:]
+
+
 def ack(endpoint, message_id, ack_response=None):
     """Generate ACK packet.
 
@@ -164,18 +316,27 @@ def ack(endpoint, message_id, ack_response=None):
     `ack_response`
         Acknowledgment response data (will be json serialized)
     """
-    if ack_response is not None:
-        if not isinstance(ack_response, tuple):
+    if ack_response is None:
+        return u'6::%s:%s' % (endpoint or '',
+                              message_id)
+
+    # Fast path for simple responses
+    response_type = type(ack_response)
+    if response_type is bool:
+        data = u'[true]' if ack_response else u'[false]'
+    elif response_type is int or response_type is long:
+        data = u'[%d]' % ack_response
+    elif response_type is unicode or response_type is str:
+        data = u'[%s]' % json.dumps(ack_response)
+    else:
+        if response_type is not tuple:
             ack_response = (ack_response,)
 
         data = json_dumps(ack_response)
 
-        return u'6::%s:%s+%s' % (endpoint or '',
-                                 message_id,
-                                 data)
-    else:
-        return u'6::%s:%s' % (endpoint or '',
-                              message_id)
+    return u'6::%s:%s+%s' % (endpoint or '',
+                             message_id,
+                             data)
 
 
 def error(endpoint, reason, advice=None):
@@ -188,14 +349,12 @@ def error(endpoint, reason, advice=None):
     `advice`
         Error advice
     """
-    return u'7::%s:%s+%s' % (endpoint or '',
-                             (reason or ''),
-                             (advice or ''))
+    return _error_packets[endpoint or '', reason or '', advice or '']
 
 
 def noop():
     """Generate noop packet."""
-    return u'8::'
+    return NOOP_PACKET
 
 
 def json_dumps(msg):
@@ -264,7 +423,10 @@ def encode_frames(packets):
 
     # Exactly one packet - don't do any frame encoding
     if len(packets) == 1:
-        return packets[0].encode('utf-8')
+        packet = packets[0]
+        if type(packet) is PreparedPacket:
+            return packet.utf8
+        return packet.encode('utf-8')
 
     # Multiple packets
     frames = u''.join(u'%s%d%s%s' % (FRAME_SEPARATOR, len(p),
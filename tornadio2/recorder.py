@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+    tornadio2.recorder
+    ~~~~~~~~~~~~~~~~~~
+
+    Packet recorder and replayer.
+
+    Recording file starts with the ``RECORDING_HEADER`` and contains records
+    of the following format::
+
+        timestamp       double, seconds since epoch
+        flags           byte, ``FLAG_OUTBOUND`` and ``FLAG_BINARY`` bits
+        session id      2 bytes length + session id
+        transport       byte length + transport name
+        packet          4 bytes length + packet (utf-8 for text packets)
+
+    All numbers are little-endian. Records are only appended, so recording
+    can be read while it is still written, incomplete record at the end of
+    the file is ignored.
+"""
+from __future__ import with_statement
+
+import os
+import time
+import struct
+import logging
+
+from tornado.web import HTTPError
+
+from tornadio2 import trace, snapshot
+
+
+logger = logging.getLogger('tornadio2.recorder')
+
+
+RECORDING_HEADER = 'TIO2REC\x01'
+
+FLAG_OUTBOUND = 1
+FLAG_BINARY = 2
+
+_record = struct.Struct('<dBHBI')
+
+
+class PacketRecorder(object):
+    """Appends traced packets to the recording file.
+
+    Used as ``PacketTracer`` sink, see ``TornadioRouter.start_recording``.
+    Recording errors never reach the message path: recorder logs the error,
+    stops writing and calls `on_error` callback.
+    """
+    def __init__(self, path, on_error=None):
+        """Constructor.
+
+        `path`
+            Recording file name. If file exists, new records are appended to
+            it.
+        `on_error`
+            Optional callback, called when record can not be written
+        """
+        self.path = path
+        self.count = 0
+        self.failed = False
+
+        self._on_error = on_error
+
+        self._file = open(path, 'ab')
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() == 0:
+            self._file.write(RECORDING_HEADER)
+
+    def record(self, session, direction, packet, transport):
+        """Write packet record.
+
+        `session`
+            Session object
+        `direction`
+            ``trace.INBOUND`` or ``trace.OUTBOUND``
+        `packet`
+            Encoded socket.io packet or binary frame
+        `transport`
+            Transport name
+        """
+        if self.failed:
+            return
+
+        flags = 0
+        if direction == trace.OUTBOUND:
+            flags |= FLAG_OUTBOUND
+
+        if isinstance(packet, unicode):
+            data = packet.encode('utf-8')
+        else:
+            flags |= FLAG_BINARY
+            data = packet
+
+        session_id = session.session_id
+
+        try:
+            self._file.write(_record.pack(time.time(),
+                                          flags,
+                                          len(session_id),
+                                          len(transport),
+                                          len(data)))
+            self._file.write(session_id)
+            self._file.write(transport)
+            self._file.write(data)
+        except (IOError, OSError, struct.error):
+            logger.error('Failed to record packet, recording stopped',
+                         exc_info=True)
+            self.failed = True
+
+            if self._on_error is not None:
+                self._on_error()
+            return
+
+        self.count += 1
+
+    def flush(self):
+        """Flush buffered records to the file"""
+        try:
+            self._file.flush()
+        except (IOError, OSError):
+            logger.error('Failed to flush recording', exc_info=True)
+
+    def close(self):
+        """Close recording file"""
+        try:
+            self._file.close()
+        except (IOError, OSError):
+            logger.error('Failed to close recording', exc_info=True)
+
+
+def read_recording(path):
+    """Read recording file. Yields tuples of timestamp, direction, session id,
+    transport name and packet. Text packets are returned as unicode strings,
+    binary frames as byte strings.
+
+    `path`
+        Recording file name
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(RECORDING_HEADER)) != RECORDING_HEADER:
+            raise ValueError('Not a packet recording: %s' % path)
+
+        while True:
+            header = f.read(_record.size)
+            if len(header) < _record.size:
+                return
+
+            timestamp, flags, sid_len, transport_len, data_len = _record.unpack(header)
+
+            body = f.read(sid_len + transport_len + data_len)
+            if len(body) < sid_len + transport_len + data_len:
+                return
+
+            session_id = body[:sid_len]
+            transport = body[sid_len:sid_len + transport_len]
+            data = body[sid_len + transport_len:]
+
+            if flags & FLAG_BINARY:
+                packet = data
+            else:
+                packet = data.decode('utf-8')
+
+            if flags & FLAG_OUTBOUND:
+                direction = trace.OUTBOUND
+            else:
+                direction = trace.INBOUND
+
+            yield timestamp, direction, session_id, transport, packet
+
+
+class ReplayHandler(object):
+    """Transport stub, which is attached to the replayed sessions and
+    discards packets sent to the client.
+    """
+    def __init__(self, name, remote_ip):
+        self.name = name
+        self.request = snapshot.SnapshotRequest(remote_ip, dict(), dict())
+        self.session = None
+
+        self.sent = 0
+
+    def attach(self, session):
+        """Attach handler to the session"""
+        if session.set_handler(self):
+            self.session = session
+            session.flush()
+
+    def send_messages(self, messages):
+        self.sent += len(messages)
+
+    def session_closed(self):
+        """Called by the session when it was closed"""
+        if self.session is not None:
+            self.session.remove_handler(self)
+            self.session = None
+
+
+class PacketReplayer(object):
+    """Replays inbound packets from the recording on the router.
+
+    For every recorded session, new session is created on the router with
+    ``ReplayHandler`` attached, so connection classes see recorded packets
+    from the recorded transports. Outbound packets are not replayed, they
+    are produced by the connection classes.
+    """
+    def __init__(self, router, path, speed=1.0, remote_ip='127.0.0.1'):
+        """Constructor.
+
+        `router`
+            ``TornadioRouter`` instance
+        `path`
+            Recording file name
+        `speed`
+            Replay speed. 1 replays packets with recorded delays, 2 is
+            twice faster and so on. If 0, packets are replayed without delays.
+        `remote_ip`
+            IP address of the replayed sessions
+        """
+        self.router = router
+        self.path = path
+        self.speed = speed
+        self.remote_ip = remote_ip
+
+        self.io_loop = router.io_loop
+
+        # Recorded session id -> replayed session
+        self.sessions = dict()
+        self.count = 0
+
+        self._records = None
+        self._next = None
+        self._offset = None
+        self._started = None
+        self._callback = None
+
+    def start(self, callback=None):
+        """Start replay.
+
+        `callback`
+            Optional callback, called when all packets were replayed
+        """
+        self._records = read_recording(self.path)
+        self._callback = callback
+        self._started = time.time()
+
+        self._schedule()
+
+    def stop(self):
+        """Stop replay and close replayed sessions"""
+        self._records = None
+
+        for s in self.sessions.itervalues():
+            if not s.is_closed:
+                s.close()
+
+        self.sessions = dict()
+
+    def _read(self):
+        for record in self._records:
+            if record[1] == trace.INBOUND:
+                return record
+
+        return None
+
+    def _schedule(self):
+        if self._records is None:
+            return
+
+        self._next = self._read()
+        if self._next is None:
+            self.stop()
+
+            if self._callback is not None:
+                self._callback()
+            return
+
+        if self._offset is None:
+            self._offset = self._next[0]
+
+        if self.speed:
+            due = self._started + (self._next[0] - self._offset) / self.speed
+            if due > time.time():
+                self.io_loop.add_timeout(due, self._run)
+                return
+
+        self.io_loop.add_callback(self._run)
+
+    def _run(self):
+        if self._records is None:
+            return
+
+        try:
+            self._replay(*self._next)
+        except Exception:
+            logger.error('Failed to replay packet', exc_info=True)
+
+        self._schedule()
+
+    def _replay(self, timestamp, direction, session_id, transport, packet):
+        s = self.sessions.get(session_id)
+        if s is None:
+            handler = ReplayHandler(transport, self.remote_ip)
+
+            try:
+                s = self.router.create_session(handler.request)
+            except HTTPError:
+                # Connection refused to open
+                return
+
+            handler.attach(s)
+
+            self.sessions[session_id] = s
+
+        if s.is_closed:
+            return
+
+        self.count += 1
+
+        if isinstance(packet, unicode):
+            s.raw_message(packet, transport)
+        else:
+            s.binary_message(packet, transport)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+    tornadio2.replay
+    ~~~~~~~~~~~~~~~~
+
+    Bounded buffer of recently sent packets, used to resume reconnecting
+    clients.
+"""
+from collections import deque
+
+from tornadio2 import proto
+
+
+# Packets which are counted and replayed
+REPLAY_TYPES = (proto.MESSAGE, proto.JSON, proto.EVENT)
+
+
+class ReplayBuffer(object):
+    """Ring buffer of recently sent data packets.
+
+    Every message, json and event packet gets sequence number, starting from
+    1, when it is sent to the client. Client is expected to count data packets it received and pass last
+    sequence number when it reconnects.
+    """
+    __slots__ = ('seq', 'packets')
+
+    def __init__(self, size):
+        """Constructor.
+
+        `size`
+            Maximum number of packets to keep
+        """
+        self.seq = 0
+        self.packets = deque(maxlen=size)
+
+    def append(self, packet):
+        """Add packet to the buffer if it is a data packet.
+
+        `packet`
+            Encoded socket.io packet
+        """
+        if packet[:1] in REPLAY_TYPES:
+            self.seq += 1
+            self.packets.append(packet)
+
+    def since(self, seq):
+        """Return list of packets sent after `seq` or None if some of them
+        are not in the buffer anymore.
+
+        `seq`
+            Last sequence number received by the client
+        """
+        if seq > self.seq:
+            return None
+
+        missing = self.seq - seq
+        if missing > len(self.packets):
+            return None
+
+        if not missing:
+            return []
+
+        return list(self.packets)[-missing:]
@@ -21,10 +21,19 @@
     Transport protocol router and main entry point for all socket.io clients.
 """
 
+import os
+import time
+import math
+import logging
+from functools import partial
+
 from tornado import ioloop, version_info
 from tornado.web import HTTPError
 
-from tornadio2 import persistent, polling, sessioncontainer, session, proto, preflight, stats
+from tornadio2 import persistent, polling, sessioncontainer, session, proto, preflight, stats, limits, snapshot, heartbeat, trace, recorder, replay
+
+logger = logging.getLogger('tornadio2.router')
+
 
 PROTOCOLS = {
     'websocket': persistent.TornadioWebSocketHandler,
@@ -39,6 +48,14 @@ DEFAULT_SETTINGS = {
     'session_check_interval': 15,
     # Session expiration in seconds
     'session_expiry': 30,
+    # Number of session container shards. If greater than 1, sessions are split by id
+    # hash and every check sweeps only one shard, so each shard is still checked every
+    # `session_check_interval` seconds.
+    'session_shards': 1,
+    # Session store, see `tornadio2.sessioncontainer.SessionStore`. If not set, sessions
+    # are stored in memory. If you pass store with sharded local container, set
+    # `session_shards` to the number of its shards.
+    'session_store': None,
     # Heartbeat time in seconds. Do not change this value unless
     # you absolutely sure that new value will work.
     'heartbeat_interval': 12,
@@ -52,10 +69,26 @@ DEFAULT_SETTINGS = {
     # ping packet and wait for response. If nothing will happen during 5 seconds,
     # TornadIO considers connection not working.
     'websocket_check': False,
+    # Send binary messages as binary websocket frames and accept binary frames from the
+    # client. Standard socket.io client does not understand binary frames, so enable this
+    # only if your client handles them.
+    'websocket_binary': False,
     # Starting from socket.io 0.9.2, client started verifying heartbeats for all transports.
     # Disable this if you're on 0.9.1 or lower, as this settings will significantly increase
     # your server load for clients with polling transports.
     'global_heartbeats': True,
+    # Adaptive heartbeats. If enabled, sessions that recently sent or received packets
+    # skip heartbeats, as any packet keeps socket.io client alive.
+    'adaptive_heartbeats': False,
+    # Heartbeat intervals per transport name (as in `enabled_protocols`), in seconds. Client
+    # expects a packet at least every `heartbeat_interval` + `client_timeout` seconds, so
+    # longer intervals are capped.
+    'transport_heartbeat_intervals': {},
+    # Heartbeat interval increase (in seconds) when IOLoop is overloaded. Capped by
+    # `client_timeout` for the same reason. 0 disables stretching.
+    'heartbeat_max_stretch': 0,
+    # Average IOLoop lateness (in milliseconds) which is considered an overload.
+    'heartbeat_load_threshold': 500,
     # Client timeout adjustment in seconds. If you see your clients disconnect without a
     # reason, increase this value.
     'client_timeout': 5,
@@ -64,6 +97,60 @@ DEFAULT_SETTINGS = {
     # check the session ID against IP address. This has consequences for spoofing sessions and
     # so on, so use with extreme caution.
     'verify_remote_ip': True,
+    # Session id prefix. Can be used to embed worker or shard identifier into
+    # session ids, so load balancer can route requests without sticky sessions.
+    'session_id_prefix': '',
+    # Query string arguments and cookies kept in the session `ConnectionInfo`. If set to
+    # a list of names, only these arguments (or cookies) are copied at handshake and the
+    # rest of the request data is released. None keeps all of them.
+    'connection_arguments': None,
+    'connection_cookies': None,
+    # Admission control. If any of the limits is reached, handshake will be rejected with
+    # 503 status code and Retry-After header. Limits set to 0 are disabled.
+    # Maximum number of concurrent sessions
+    'max_sessions': 0,
+    # Global handshake rate (per second) and burst size
+    'handshake_rate': 0,
+    'handshake_burst': 0,
+    # Per-IP handshake rate (per second) and burst size
+    'ip_handshake_rate': 0,
+    'ip_handshake_burst': 0,
+    # Per-session inbound limits, checked before packets are decoded. Limits set to 0
+    # are disabled.
+    # Maximum size of the single packet, in characters
+    'max_frame_size': 0,
+    # Maximum number of packets in one polling POST request. Together with `max_frame_size`
+    # it also limits size of the POST body, which is checked before it is decoded.
+    'max_frames_per_post': 0,
+    # Maximum number of packets and characters per second received from one session
+    'inbound_packets_ps': 0,
+    'inbound_bytes_ps': 0,
+    # What to do with sessions that exceeded inbound limits: 'close' will close the
+    # session, 'drop' will ignore excessive packets.
+    'inbound_limit_action': 'close',
+    # Maximum size (in characters) of packets sent in one polling response. Packets that
+    # do not fit will be sent with the next poll, but at least one packet is always sent.
+    # 0 means no limit.
+    'max_response_size': 0,
+    # Same, but only for packets sent with the `bulk` flag.
+    'bulk_budget': 0,
+    # Replay buffer size. If set, every session keeps this number of recently sent
+    # message, json and event packets, so client which lost its session can resume
+    # it by passing `resume` (old session id) and `seq` (number of data packets it
+    # received) query string arguments in the handshake request.
+    'replay_buffer_size': 0,
+    # Session snapshot file. If set, router will restore sessions from this file on startup
+    # and remove it. Call `save_snapshot()` on shutdown to save them.
+    'session_snapshot': None,
+    # Snapshot serializer: object with `dumps` and `loads` methods. JSON is used by default.
+    'snapshot_serializer': None,
+    # Event loop watchdog. If enabled, TornadIO will measure IOLoop scheduling lag every
+    # `watchdog_interval` milliseconds and will capture stack trace of the callbacks that
+    # block IOLoop for more than `watchdog_threshold` milliseconds. Results are available
+    # through the `stats` property of the router.
+    'loop_watchdog': False,
+    'watchdog_interval': 500,
+    'watchdog_threshold': 1000,
     }
 
 
@@ -74,45 +161,60 @@ class HandshakeHandler(preflight.PreflightHandler):
         self.server = server
 
     def get(self, version, *args, **kwargs):
-        try:
-            self.server.stats.connection_opened()
+        server = self.server
 
-            # Only version 1 is supported now
-            if version != '1':
-                raise HTTPError(503, "Invalid socket.io protocol version")
+        profiler = server.stats.profiler
+        profiling = profiler.enabled
+        if profiling:
+            started = time.time()
 
-            sess = self.server.create_session(self.request)
+        server.stats.on_handshake()
 
-            settings = self.server.settings
+        # Only version 1 is supported now
+        if version != '1':
+            raise HTTPError(503, "Invalid socket.io protocol version")
 
-            # TODO: Fix heartbeat timeout. For now, it is adding 5 seconds to the client timeout.
-            data = '%s:%d:%d:%s' % (
-                sess.session_id,
-                # TODO: Fix me somehow a well. 0.9.2 will drop connection is no
-                # heartbeat was sent over
-                settings['heartbeat_interval'] + settings['client_timeout'],
-                # TODO: Fix me somehow.
-                settings['xhr_polling_timeout'] + settings['client_timeout'],
-                ','.join(t for t in self.server.settings.get('enabled_protocols'))
-                )
+        # Shed load if server is draining or saturated
+        retry_after = 0
 
-            if self.server.settings['global_heartbeats']:
-                sess.reset_heartbeat()
+        if server.draining:
+            retry_after = 1
+        elif server.admission is not None:
+            retry_after = server.admission.admit(self.request.remote_ip,
+                                                 server.stats.active_sessions)
 
-            jsonp = self.get_argument('jsonp', None)
-            if jsonp is not None:
-                self.set_header('Content-Type', 'application/javascript; charset=UTF-8')
-
-                data = 'io.j[%s](%s);' % (jsonp, proto.json_dumps(data))
-            else:
-                self.set_header('Content-Type', 'text/plain; charset=UTF-8')
+        if retry_after:
+            server.stats.on_handshake_rejected()
 
             self.preflight()
-
-            self.write(data)
+            self.set_status(503)
+            self.set_header('Retry-After', int(math.ceil(retry_after)))
             self.finish()
-        finally:
-            self.server.stats.connection_closed()
+            return
+
+        sess = server.create_session(self.request)
+
+        # Everything except session id is pre-rendered by the router
+        data = sess.session_id + server._handshake_suffix
+
+        if server._global_heartbeats:
+            sess.reset_heartbeat()
+
+        jsonp = self.get_argument('jsonp', None)
+        if jsonp is not None:
+            self.set_header('Content-Type', 'application/javascript; charset=UTF-8')
+
+            data = 'io.j[%s](%s);' % (jsonp, proto.json_dumps(data))
+        else:
+            self.set_header('Content-Type', 'text/plain; charset=UTF-8')
+
+        self.preflight()
+
+        self.write(data)
+        self.finish()
+
+        if profiling:
+            profiler.add('handshake', started)
 
 
 class TornadioRouter(object):
@@ -150,10 +252,89 @@ class TornadioRouter(object):
         if user_settings:
             self.settings.update(user_settings)
 
+        # Pre-render constant part of the handshake response
+        # TODO: Fix heartbeat timeout. For now, it is adding 5 seconds to the client timeout.
+        self._handshake_suffix = ':%d:%d:%s' % (
+            # TODO: Fix me somehow a well. 0.9.2 will drop connection is no
+            # heartbeat was sent over
+            self.settings['heartbeat_interval'] + self.settings['client_timeout'],
+            # TODO: Fix me somehow.
+            self.settings['xhr_polling_timeout'] + self.settings['client_timeout'],
+            ','.join(t for t in self.settings.get('enabled_protocols'))
+            )
+
+        self._global_heartbeats = self.settings['global_heartbeats']
+        self._session_expiry = self.settings['session_expiry']
+
         # Sessions
-        self._sessions = sessioncontainer.SessionContainer()
+        shards = self.settings['session_shards']
+        if self.settings['session_store'] is not None:
+            self._sessions = self.settings['session_store']
+        elif shards > 1:
+            self._sessions = sessioncontainer.ShardedSessionContainer(shards)
+        else:
+            self._sessions = sessioncontainer.SessionContainer()
+        self._session_ids = sessioncontainer.SessionIdGenerator(
+                                self.settings['session_id_prefix'])
+
+        # Heartbeats. Client will disconnect if it did not receive anything during
+        # announced heartbeat timeout, so leave one second for the wheel resolution.
+        interval = self.settings['heartbeat_interval']
+        longest = interval + self.settings['client_timeout'] - 1
+
+        transport_intervals = dict()
+        for name, value in self.settings['transport_heartbeat_intervals'].iteritems():
+            if name not in PROTOCOLS:
+                logger.warning('Ignoring heartbeat interval for unknown transport %s' % name)
+                continue
 
-        check_interval = self.settings['session_check_interval'] * 1000
+            if value > longest:
+                logger.warning('Heartbeat interval for %s capped to %d seconds' % (name, longest))
+                value = longest
+
+            # Sessions know name of the transport handler
+            transport_intervals[PROTOCOLS[name].name] = value * 1000
+
+        max_stretch = min(self.settings['heartbeat_max_stretch'], max(0, longest - interval))
+
+        self.heartbeats = heartbeat.HeartbeatWheel(
+                                interval * 1000,
+                                self.io_loop,
+                                transport_intervals=transport_intervals,
+                                max_stretch=max_stretch * 1000,
+                                load_threshold=self.settings['heartbeat_load_threshold'],
+                                adaptive=self.settings['adaptive_heartbeats'])
+        self.heartbeats.start()
+
+        # Shutdown
+        self.draining = False
+
+        # Replay buffer
+        self.replay_size = self.settings['replay_buffer_size']
+
+        # Admission control
+        self.admission = None
+        if (self.settings['max_sessions'] or self.settings['handshake_rate'] or
+            self.settings['ip_handshake_rate']):
+            self.admission = limits.AdmissionControl(
+                                self.settings['max_sessions'],
+                                self.settings['handshake_rate'],
+                                self.settings['handshake_burst'],
+                                self.settings['ip_handshake_rate'],
+                                self.settings['ip_handshake_burst'],
+                                self.settings['session_check_interval'])
+
+        self.inbound_limits = None
+        if (self.settings['max_frame_size'] or self.settings['max_frames_per_post'] or
+            self.settings['inbound_packets_ps'] or self.settings['inbound_bytes_ps']):
+            self.inbound_limits = limits.InboundLimits(
+                                self.settings['max_frame_size'],
+                                self.settings['max_frames_per_post'],
+                                self.settings['inbound_packets_ps'],
+                                self.settings['inbound_bytes_ps'],
+                                self.settings['inbound_limit_action'])
+
+        check_interval = self.settings['session_check_interval'] * 1000 / max(1, shards)
         self._sessions_cleanup = ioloop.PeriodicCallback(self._sessions.expire,
                                                          check_interval,
                                                          self.io_loop)
@@ -163,6 +344,15 @@ class TornadioRouter(object):
         self.stats = stats.StatsCollector()
         self.stats.start(self.io_loop)
 
+        if self.settings['loop_watchdog']:
+            self.stats.start_watchdog(self.io_loop,
+                                      self.settings['watchdog_interval'],
+                                      self.settings['watchdog_threshold'])
+
+        # Packet tracer, None when tracing is disabled
+        self.tracer = None
+        self.recorder = None
+
         # Initialize URLs
         self._transport_urls = [
             (r'/%s/(?P<version>\d+)/$' % namespace,
@@ -170,6 +360,11 @@ class TornadioRouter(object):
                 dict(server=self))
             ]
 
+        # Restore sessions saved before restart
+        snapshot_path = self.settings['session_snapshot']
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.restore_snapshot(snapshot_path)
+
         for t in self.settings.get('enabled_protocols', dict()):
             proto = PROTOCOLS.get(t)
 
@@ -202,18 +397,261 @@ class TornadioRouter(object):
             Request that created the session. Will be used to get query string
             parameters and cookies.
         """
-        # TODO: Possible optimization here for settings.get
+        previous = missed = None
+        if self.replay_size:
+            previous, missed = self._find_resumed(request)
+
         s = session.Session(self._connection,
                             self,
                             request,
-                            self.settings.get('session_expiry')
+                            self._session_expiry,
+                            self._session_ids.generate(),
+                            missed=missed
                             )
 
         self._sessions.add(s)
 
+        # Client moved to the new session, so close the old one
+        if previous is not None:
+            self._sessions.remove(previous.session_id)
+
+        return s
+
+    def _find_resumed(self, request):
+        """Find session that client wants to resume. Returns tuple of the
+        old session and list of the packets missed by the client or
+        (None, None) if session can not be resumed.
+        """
+        args = request.arguments
+
+        session_id = args.get('resume')
+        if not session_id:
+            return None, None
+
+        try:
+            seq = int(args.get('seq', ('0',))[0])
+        except ValueError:
+            return None, None
+
+        previous = self._sessions.get(session_id[0])
+        if (previous is None or previous.is_closed or
+            previous._replay is None):
+            return None, None
+
+        if (self.settings['verify_remote_ip'] and
+            previous.remote_ip != request.remote_ip):
+            logger.error('Attempted to resume session %s (%s) from different IP (%s)' % (
+                          previous.session_id,
+                          previous.remote_ip,
+                          request.remote_ip
+                          ))
+            return None, None
+
+        missed = previous._replay.since(seq)
+        if missed is None:
+            return None, None
+
+        # Packets, which were not sent yet, are moved to the new session
+        missed.extend(pack for pack in previous.get_pending()
+                      if pack[:1] in replay.REPLAY_TYPES)
+
+        return previous, missed
+
+    def restore_session(self, request, session_id, state, queue=None,
+                        expires=None):
+        """Recreate session saved in the snapshot and returns it.
+
+        `request`
+            Request-like object with saved IP address, query string
+            parameters and cookies.
+        `session_id`
+            Saved session id
+        `state`
+            Saved connection state
+        `queue`
+            Saved queued packets. They are queued before packets sent by the
+            ``on_open`` handler of the restored connection.
+        `expires`
+            Number of seconds left till expiration of the saved session. If
+            not set, session gets full `session_expiry`.
+        """
+        s = session.Session(self._connection,
+                            self,
+                            request,
+                            self._session_expiry,
+                            session_id,
+                            state,
+                            pending=queue)
+
+        if expires is not None and s.expiry is not None:
+            s.expiry_date = time.time() + expires
+
+        self._sessions.add(s)
+
+        if self._global_heartbeats:
+            s.reset_heartbeat()
+
         return s
 
     def get_session(self, session_id):
         """Get session by session id
         """
-        return self._sessions.get(session_id)
+        s = self._sessions.get(session_id)
+
+        if s is not None:
+            self._sessions.touch(s)
+
+        return s
+
+    def get_session_owner(self, session_id):
+        """Return owner id of the session or None if session is not known.
+        Only shared session stores know about sessions of other processes.
+        """
+        return self._sessions.owner(session_id)
+
+    # Snapshots
+    def save_snapshot(self, path=None):
+        """Save open sessions to the snapshot file. Returns number of
+        saved sessions.
+
+        `path`
+            Snapshot file name. Defaults to `session_snapshot` setting.
+        """
+        return snapshot.save(self,
+                             path or self.settings['session_snapshot'],
+                             self.settings['snapshot_serializer'])
+
+    def restore_snapshot(self, path=None):
+        """Restore sessions from the snapshot file. Returns number of
+        restored sessions.
+
+        `path`
+            Snapshot file name. Defaults to `session_snapshot` setting.
+        """
+        return snapshot.restore(self,
+                                path or self.settings['session_snapshot'],
+                                self.settings['snapshot_serializer'])
+
+    # Shutdown
+    def drain(self, window=30, batch_size=500, callback=None):
+        """Gracefully close all sessions.
+
+        Router will stop accepting new handshakes and will ask connected clients
+        to reconnect in waves of `batch_size` sessions, spread over `window`
+        seconds, so reconnecting clients won't hit other servers all at once.
+        For every session in the wave, queued messages are flushed and `on_close`
+        is called.
+
+        Closed sessions stay in the session container till they expire, so
+        polling clients can still grab messages that were queued for them.
+
+        `window`
+            Time, in seconds, to spread reconnection waves over
+        `batch_size`
+            Maximum number of sessions to close in one wave
+        `callback`
+            Optional function to call when all sessions were closed. For
+            example, it can stop the IOLoop.
+        """
+        self.draining = True
+
+        sessions = [s for s in self._sessions.values() if not s.is_closed]
+
+        waves = max(1, int(math.ceil(len(sessions) / float(batch_size))))
+        interval = float(window) / waves
+
+        logger.info('Draining %d sessions in %d waves' % (len(sessions), waves))
+
+        self._drain_wave(sessions, batch_size, interval, callback)
+
+    def _drain_wave(self, sessions, batch_size, interval, callback):
+        batch = sessions[:batch_size]
+        del sessions[:batch_size]
+
+        reconnect = proto.error(None, None, proto.ADVICE_RECONNECT)
+
+        for s in batch:
+            if s.is_closed:
+                continue
+
+            try:
+                s.send_message(reconnect)
+                s.close()
+            except Exception:
+                logger.error('Failed to close session %s' % s.session_id,
+                             exc_info=True)
+
+        if sessions:
+            self.io_loop.add_timeout(time.time() + interval,
+                                     partial(self._drain_wave,
+                                             sessions,
+                                             batch_size,
+                                             interval,
+                                             callback))
+        elif callback is not None:
+            callback()
+
+    # Profiling
+    def start_profiling(self, reset=True):
+        """Start collecting per-stage timings of the message pipeline.
+
+        `reset`
+            Discard previously collected timings
+        """
+        if reset:
+            self.stats.profiler.reset()
+
+        self.stats.profiler.enabled = True
+
+    def stop_profiling(self):
+        """Stop collecting message pipeline timings"""
+        self.stats.profiler.enabled = False
+
+    def dump_profile(self):
+        """Return per-stage breakdown of the message pipeline timings"""
+        return self.stats.profiler.dump()
+
+    # Tracing
+    def start_tracing(self, sample=1, sessions=None, sink=None):
+        """Start tracing sent and received packets. Returns ``PacketTracer``.
+
+        `sample`
+            Trace only every `sample`-th packet
+        `sessions`
+            Optional list of session ids to trace
+        `sink`
+            Optional callable which accepts session, direction, packet and
+            transport name. By default, packets are logged to the
+            `tornadio2.trace` logger.
+        """
+        self.tracer = trace.PacketTracer(sample, sessions, sink)
+        return self.tracer
+
+    def stop_tracing(self):
+        """Stop tracing packets"""
+        self.tracer = None
+
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def start_recording(self, path, sample=1, sessions=None):
+        """Start recording sent and received packets to the file. Recording
+        replaces packet tracing. Returns ``PacketRecorder``.
+
+        `path`
+            Recording file name
+        `sample`
+            Record only every `sample`-th packet
+        `sessions`
+            Optional list of session ids to record
+        """
+        self.stop_tracing()
+
+        self.recorder = recorder.PacketRecorder(path, self.stop_recording)
+        self.start_tracing(sample, sessions, self.recorder.record)
+        return self.recorder
+
+    def stop_recording(self):
+        """Stop recording packets and close recording file"""
+        self.stop_tracing()
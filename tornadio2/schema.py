@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+    tornadio2.schema
+    ~~~~~~~~~~~~~~~~
+
+    Event payload schemas.
+
+    Schema is built from plain Python objects:
+
+    * type or tuple of types: value should be an instance of it, for example
+      ``int``, ``basestring`` or ``(int, float)``
+    * dictionary: value should be a dictionary, keys are validated by their
+      schemas. Keys are required unless their schema is wrapped with
+      ``Optional``. Other keys are allowed.
+    * list with one element: value should be a list and every item should
+      match the element schema
+    * any other callable: custom validator, which returns True if value is
+      valid
+
+    Schemas are compiled into nested closures once, so validation does not
+    interpret schema on every call.
+"""
+
+
+class Optional(object):
+    """Marks dictionary key as optional"""
+    __slots__ = ('schema',)
+
+    def __init__(self, schema):
+        self.schema = schema
+
+
+def _is_types(schema):
+    if isinstance(schema, type):
+        return True
+
+    if isinstance(schema, tuple):
+        return all(isinstance(t, type) for t in schema)
+
+    return False
+
+
+def compile_schema(schema):
+    """Compile schema into validator function, which accepts value and
+    returns True if it is valid.
+
+    `schema`
+        Schema
+    """
+    if _is_types(schema):
+        return lambda value: isinstance(value, schema)
+
+    if isinstance(schema, dict):
+        keys = []
+        for key, value in schema.iteritems():
+            required = not isinstance(value, Optional)
+            if not required:
+                value = value.schema
+
+            keys.append((key, compile_schema(value), required))
+
+        def validate_dict(value):
+            if not isinstance(value, dict):
+                return False
+
+            for key, validate, required in keys:
+                if key in value:
+                    if not validate(value[key]):
+                        return False
+                elif required:
+                    return False
+
+            return True
+
+        return validate_dict
+
+    if isinstance(schema, list):
+        if len(schema) != 1:
+            raise ValueError('List schema should have exactly one element')
+
+        validate_item = compile_schema(schema[0])
+
+        def validate_list(value):
+            if not isinstance(value, list):
+                return False
+
+            for item in value:
+                if not validate_item(item):
+                    return False
+
+            return True
+
+        return validate_list
+
+    if callable(schema):
+        return schema
+
+    raise ValueError('Invalid schema: %r' % (schema,))
+
+
+def compile_arguments(schema, names):
+    """Compile event arguments schema. Returns validator function, which
+    accepts event args and kwargs.
+
+    `schema`
+        Dictionary of argument schemas by argument name
+    `names`
+        Handler argument names, in order. Used to validate positional
+        arguments.
+    """
+    if not isinstance(schema, dict):
+        raise ValueError('Event schema should be a dictionary')
+
+    validate = compile_schema(schema)
+    names = tuple(names)
+
+    def validate_arguments(args, kwargs):
+        if args:
+            kwargs = dict(zip(names, args))
+
+        return validate(kwargs)
+
+    return validate_arguments
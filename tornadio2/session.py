@@ -21,6 +21,7 @@
     Active TornadIO2 connection session.
 """
 
+import time
 import urlparse
 import logging
 
@@ -29,7 +30,39 @@ logger = logging.getLogger('tornadio2.session')
 
 from tornado.web import HTTPError
 
-from tornadio2 import sessioncontainer, proto, periodic, stats
+from tornadio2 import sessioncontainer, proto, stats, replay, trace
+
+
+# Packets which are sent before all other queued packets
+CONTROL_TYPES = (proto.HEARTBEAT, proto.ACK, proto.NOOP)
+
+# Packets which must not overtake packets queued before them
+TERMINAL_TYPES = (proto.DISCONNECT, proto.ERROR)
+
+INFINITY = float('inf')
+
+
+def _take(lane, messages, budget):
+    """Move packets that fit into the `budget` from the `lane` to the
+    `messages` list. At least one packet is taken if `messages` is empty.
+    Returns remaining budget and the rest of the lane or None.
+    """
+    count = 0
+
+    for pack in lane:
+        size = len(pack)
+        if size > budget and (count or messages):
+            break
+
+        budget -= size
+        count += 1
+
+    if count == len(lane):
+        messages.extend(lane)
+        return budget, None
+
+    messages.extend(lane[:count])
+    return budget, lane[count:]
 
 
 class ConnectionInfo(object):
@@ -45,11 +78,31 @@ class ConnectionInfo(object):
         Collection of cookies
     `arguments`
         Collection of the query string arguments
+    `resumed`
+        True if session resumed previous session of the client and missed
+        messages were replayed
+
+    If `connection_arguments` or `connection_cookies` settings are set,
+    `arguments` and `cookies` contain only listed names and argument values
+    are tuples.
     """
-    def __init__(self, ip, arguments, cookies):
+    __slots__ = ('ip', 'cookies', 'arguments', 'resumed')
+
+    def __init__(self, ip, arguments, cookies, resumed=False,
+                 argument_names=None, cookie_names=None):
         self.ip = ip
+
+        if argument_names is not None:
+            arguments = dict((name, tuple(arguments[name]))
+                             for name in argument_names if name in arguments)
+
+        if cookie_names is not None:
+            cookies = dict((name, cookies[name])
+                           for name in cookie_names if name in cookies)
+
         self.cookies = cookies
         self.arguments = arguments
+        self.resumed = resumed
 
     def get_argument(self, name):
         """Return single argument by name"""
@@ -74,8 +127,25 @@ class Session(sessioncontainer.SessionBase):
         Remote IP
     `is_closed`
         Check if session is closed or not.
+
+    Outgoing packets are queued in three lanes. Heartbeats, acks and noops are
+    flushed first, then regular packets and then bulk packets. Polling
+    transports can limit amount of bulk data sent in one response. Disconnect
+    and error packets are queued after all pending bulk packets.
+
+    To keep memory footprint of idle sessions low, session uses ``__slots__``
+    and allocates send queue and endpoint dictionary only when they're needed.
+    If you subclass ``Session`` and want to store arbitrary attributes, do not
+    declare ``__slots__`` in your subclass.
     """
-    def __init__(self, conn, server, request, expiry=None):
+    __slots__ = ('server', 'send_queue', 'handler', 'remote_ip', 'conn',
+                 'info', 'endpoints', '_heartbeat_slot', '_heartbeat_due',
+                 '_missed_heartbeats', '_transport',
+                 '_inbound', '_replay', '_keyed', '_control_queue',
+                 '_bulk_queue')
+
+    def __init__(self, conn, server, request, expiry=None, session_id=None,
+                 state=None, missed=None, pending=None):
         """Session constructor.
 
         `conn`
@@ -86,14 +156,41 @@ class Session(sessioncontainer.SessionBase):
             Request handler that created new session
         `expiry`
             Session expiry
+        `session_id`
+            Optional session id. If not provided, will generate new one.
+        `state`
+            Connection state, if session is restored from the snapshot. Client
+            already received connect packet for restored sessions, so it won't
+            be sent again.
+        `missed`
+            Packets, missed by the client, that should be sent right after
+            connect packet if session resumes previous session.
+        `pending`
+            Packets, that were queued when session was saved to the snapshot.
+            They are queued before packets sent by ``on_open``.
         """
         # Initialize session
-        super(Session, self).__init__(None, expiry)
+        super(Session, self).__init__(session_id, expiry)
 
         self.server = server
-        self.send_queue = []
+        self.send_queue = None
         self.handler = None
 
+        # Name of the last attached transport
+        self._transport = None
+
+        # Priority lanes, created when needed
+        self._control_queue = None
+        self._bulk_queue = None
+
+        # Positions of the keyed packets in the send queue
+        self._keyed = None
+
+        # Replay buffer
+        self._replay = None
+        if server.replay_size:
+            self._replay = replay.ReplayBuffer(server.replay_size)
+
         # Stats
         server.stats.session_opened()
 
@@ -102,21 +199,40 @@ class Session(sessioncontainer.SessionBase):
         # Create connection instance
         self.conn = conn(self)
 
+        if state is not None:
+            self.conn.set_state(state)
+
         # Call on_open.
+        settings = server.settings
         self.info = ConnectionInfo(request.remote_ip,
-                              request.arguments,
-                              request.cookies)
+                                   request.arguments,
+                                   request.cookies,
+                                   missed is not None,
+                                   settings.get('connection_arguments'),
+                                   settings.get('connection_cookies'))
 
         # If everything is fine - continue
-        self.send_message(proto.connect())
+        if state is None:
+            self.send_message(proto.connect())
+
+        if missed:
+            for pack in missed:
+                self.send_message(pack)
+
+        if pending:
+            for pack in pending:
+                self.send_message(pack)
 
         # Heartbeat related stuff
-        self._heartbeat_timer = None
-        self._heartbeat_interval = self.server.settings['heartbeat_interval'] * 1000
+        self._heartbeat_slot = None
+        self._heartbeat_due = 0
         self._missed_heartbeats = 0
 
-        # Endpoints
-        self.endpoints = dict()
+        # Endpoints, created on first endpoint connection
+        self.endpoints = None
+
+        # Inbound rate limiting window
+        self._inbound = None
 
         result = self.conn.on_open(self.info)
         if result is not None and not result:
@@ -160,6 +276,15 @@ class Session(sessioncontainer.SessionBase):
         self.handler = handler
         self.promote()
 
+        # Heartbeat interval can depend on the transport, so reschedule
+        # heartbeat when client attaches with another transport
+        if handler.name != self._transport:
+            self._transport = handler.name
+
+            heartbeats = self.server.heartbeats
+            if heartbeats.transport_ticks and self._heartbeat_slot is not None:
+                heartbeats.add(self)
+
         # Stats
         self.server.stats.connection_opened()
 
@@ -180,31 +305,159 @@ class Session(sessioncontainer.SessionBase):
 
         self.server.stats.connection_closed()
 
-    def send_message(self, pack):
+    def send_message(self, pack, key=None, bulk=False):
         """Send socket.io encoded message
 
         `pack`
             Encoded socket.io message
+        `key`
+            Optional coalescing key. If packet with the same key is still
+            waiting in the send queue, it will be replaced with the new one.
+        `bulk`
+            Queue packet in the bulk lane. Bulk packets are sent after all
+            other packets and polling transports can spread them over
+            multiple responses.
         """
-        logger.debug('<<< ' + pack)
+        tracer = self.server.tracer
+        if tracer is not None:
+            tracer.trace(self, trace.OUTBOUND, pack)
 
         # TODO: Possible optimization if there's on-going connection - there's no
         # need to queue messages?
 
-        self.send_queue.append(pack)
+        if pack[:1] in CONTROL_TYPES:
+            if self._control_queue is None:
+                self._control_queue = [pack]
+            else:
+                self._control_queue.append(pack)
+        elif bulk:
+            if self._bulk_queue is None:
+                self._bulk_queue = [pack]
+            else:
+                self._bulk_queue.append(pack)
+        else:
+            queue = self.send_queue
+            if queue is None:
+                queue = self.send_queue = []
+
+            # Client should receive pending bulk packets before it is
+            # disconnected
+            if self._bulk_queue and pack[:1] in TERMINAL_TYPES:
+                queue.extend(self._bulk_queue)
+                self._bulk_queue = None
+
+            if key is not None:
+                keyed = self._keyed
+                if keyed is None:
+                    keyed = self._keyed = dict()
+
+                pos = keyed.get(key)
+                if pos is not None:
+                    queue[pos] = pack
+                    self.server.stats.on_packet_coalesced()
+                    return
+
+                keyed[key] = len(queue)
+
+            queue.append(pack)
+
         self.flush()
 
+    @property
+    def has_pending(self):
+        """Check if session has queued packets"""
+        return bool(self.send_queue or self._control_queue or self._bulk_queue)
+
+    def get_pending(self):
+        """Return list of queued packets in the order they will be sent"""
+        return ((self._control_queue or []) +
+                (self.send_queue or []) +
+                (self._bulk_queue or []))
+
     def flush(self):
         """Flush message queue if there's an active connection running"""
-        if self.handler is None:
+        handler = self.handler
+        if handler is None:
             return
 
-        if not self.send_queue:
+        if not self.has_pending:
             return
 
-        self.handler.send_messages(self.send_queue)
+        budget = getattr(handler, 'response_budget', None)
+        bulk_budget = getattr(handler, 'bulk_budget', None)
+
+        control = self._control_queue
+        queue = self.send_queue
+        bulk = self._bulk_queue
+        keyed = self._keyed
+
+        messages = []
+
+        if budget is None and bulk_budget is None:
+            if control:
+                messages.extend(control)
+            if queue:
+                messages.extend(queue)
+            if bulk:
+                messages.extend(bulk)
+
+            control = queue = bulk = keyed = None
+        else:
+            if budget is None:
+                budget = INFINITY
+
+            if control:
+                budget, control = _take(control, messages, budget)
+
+            if queue:
+                taken = len(queue)
+                budget, queue = _take(queue, messages, budget)
+
+                # Update positions of the keyed packets left in the queue
+                if queue is not None and keyed is not None:
+                    taken -= len(queue)
+                    keyed = dict((k, pos - taken)
+                                 for k, pos in keyed.iteritems()
+                                 if pos >= taken) or None
+                else:
+                    keyed = None
+            else:
+                keyed = None
 
-        self.send_queue = []
+            if bulk:
+                if bulk_budget is not None:
+                    budget = min(budget, bulk_budget)
+
+                budget, bulk = _take(bulk, messages, budget)
+
+        profiler = self.server.stats.profiler
+        if profiler.enabled:
+            started = time.time()
+            handler.send_messages(messages)
+            profiler.add('write', started)
+        else:
+            handler.send_messages(messages)
+
+        # Sequence numbers are assigned in the order client receives packets
+        buf = self._replay
+        if buf is not None:
+            for pack in messages:
+                buf.append(pack)
+
+        self.send_queue = queue
+        self._keyed = keyed
+        self._control_queue = control
+        self._bulk_queue = bulk
+
+        # Outgoing traffic keeps client alive
+        heartbeats = self.server.heartbeats
+        if heartbeats.adaptive and self._heartbeat_slot is not None:
+            heartbeats.delay(self)
+
+        # Streaming transports stay attached, so continue with the rest of
+        # the queued packets on the next IOLoop iteration
+        if self.handler is not None and self.has_pending:
+            self.server.io_loop.add_callback(self.flush)
 
         # If session was closed, detach connection
         if self.is_closed and self.handler is not None:
@@ -221,8 +474,9 @@ class Session(sessioncontainer.SessionBase):
         if endpoint is None:
             if not self.conn.is_closed:
                 # Close child connections
-                for k in self.endpoints.keys():
-                    self.disconnect_endpoint(k)
+                if self.endpoints:
+                    for k in self.endpoints.keys():
+                        self.disconnect_endpoint(k)
 
                 # Close parent connections
                 try:
@@ -254,27 +508,31 @@ class Session(sessioncontainer.SessionBase):
     # Heartbeats
     def reset_heartbeat(self):
         """Reset hearbeat timer"""
-        self.stop_heartbeat()
-
-        self._heartbeat_timer = periodic.Callback(self._heartbeat,
-                                                  self._heartbeat_interval,
-                                                  self.server.io_loop)
-        self._heartbeat_timer.start()
+        self.server.heartbeats.add(self)
 
     def stop_heartbeat(self):
         """Stop active heartbeat"""
-        if self._heartbeat_timer is not None:
-            self._heartbeat_timer.stop()
-            self._heartbeat_timer = None
+        if self._heartbeat_slot is not None:
+            self.server.heartbeats.remove(self)
 
     def delay_heartbeat(self):
         """Delay active heartbeat"""
-        if self._heartbeat_timer is not None:
-            self._heartbeat_timer.delay()
+        if self._heartbeat_slot is not None:
+            self.server.heartbeats.delay(self)
 
     def _heartbeat(self):
         """Heartbeat callback"""
-        self.send_message(proto.heartbeat())
+        handler = self.handler
+
+        # Persistent transports can write pre-encoded heartbeat frame
+        if handler is not None and hasattr(handler, 'send_heartbeat'):
+            tracer = self.server.tracer
+            if tracer is not None:
+                tracer.trace(self, trace.OUTBOUND, proto.heartbeat())
+
+            handler.send_heartbeat()
+        else:
+            self.send_message(proto.heartbeat())
 
         self._missed_heartbeats += 1
 
@@ -293,6 +551,9 @@ class Session(sessioncontainer.SessionBase):
 
         endpoint = urldata.path
 
+        if self.endpoints is None:
+            self.endpoints = dict()
+
         conn = self.endpoints.get(endpoint, None)
         if conn is None:
             conn_class = self.conn.get_endpoint(endpoint)
@@ -314,7 +575,7 @@ class Session(sessioncontainer.SessionBase):
         `endpoint`
             endpoint name
         """
-        if endpoint not in self.endpoints:
+        if not self.endpoints or endpoint not in self.endpoints:
             logger.error('Invalid endpoint for disconnect %s' % endpoint)
             return
 
@@ -332,20 +593,77 @@ class Session(sessioncontainer.SessionBase):
             Endpoint name. If set to None, will return default connection object.
         """
         if endpoint:
+            if self.endpoints is None:
+                return None
             return self.endpoints.get(endpoint)
         else:
             return self.conn
 
+    def binary_message(self, frame, transport=None):
+        """Binary websocket frame handler.
+
+        `frame`
+            Binary frame payload
+        `transport`
+            Name of the transport which received the frame
+        """
+        limits = self.server.inbound_limits
+        if limits is not None and not limits.accept(self, frame):
+            return
+
+        tracer = self.server.tracer
+        if tracer is not None:
+            tracer.trace(self, trace.INBOUND, frame, transport)
+
+        try:
+            endpoint, data = proto.decode_binary_frame(frame)
+        except ValueError:
+            logger.error('Malformed binary frame')
+            return
+
+        conn = self.get_connection(endpoint)
+        if conn is None:
+            logger.error('Invalid endpoint: %s' % endpoint)
+            return
+
+        conn.on_binary(data)
+
     # Message handler
-    def raw_message(self, msg):
+    def raw_message(self, msg, transport=None):
         """Socket.IO message handler.
 
         `msg`
             Raw socket.io message to handle
+        `transport`
+            Name of the transport which received the message
         """
-        try:
-            logger.debug('>>> ' + msg)
+        # Enforce inbound limits before doing anything with the packet
+        limits = self.server.inbound_limits
+        if limits is not None and not limits.accept(self, msg):
+            return
+
+        # Any incoming packet means that client is alive
+        heartbeats = self.server.heartbeats
+        if heartbeats.adaptive:
+            self._missed_heartbeats = 0
+            if self._heartbeat_slot is not None:
+                heartbeats.delay(self)
+
+        collector = self.server.stats
+
+        # Only running watchdog needs to know what is being processed
+        watched = collector.watchdog is not None
+
+        profiler = collector.profiler
+        profiling = profiler.enabled
+        if profiling:
+            started = time.time()
 
+        tracer = self.server.tracer
+        if tracer is not None:
+            tracer.trace(self, trace.INBOUND, msg, transport)
+
+        try:
             parts = msg.split(':', 3)
             if len(parts) == 3:
                 msg_type, msg_id, msg_endpoint = parts
@@ -353,6 +671,10 @@ class Session(sessioncontainer.SessionBase):
             else:
                 msg_type, msg_id, msg_endpoint, msg_data = parts
 
+            # Let event loop watchdog know what is being processed
+            if watched:
+                collector.processing = (self.session_id, msg_endpoint, msg_type)
+
             # Packets that don't require valid endpoint
             if msg_type == proto.DISCONNECT:
                 if not msg_endpoint:
@@ -377,14 +699,30 @@ class Session(sessioncontainer.SessionBase):
             if msg_type == proto.HEARTBEAT:
                 self._missed_heartbeats = 0
             elif msg_type == proto.MESSAGE:
+                if profiling:
+                    profiler.add('parse', started)
+                    started = time.time()
+
                 # Handle text message
                 conn.on_message(msg_data)
 
+                if profiling:
+                    profiler.add('dispatch', started)
+
                 if msg_id:
                     self.send_message(proto.ack(msg_endpoint, msg_id))
             elif msg_type == proto.JSON:
                 # Handle json message
-                conn.on_message(proto.json_load(msg_data))
+                data = proto.json_load(msg_data)
+
+                if profiling:
+                    profiler.add('parse', started)
+                    started = time.time()
+
+                conn.on_message(data)
+
+                if profiling:
+                    profiler.add('dispatch', started)
 
                 if msg_id:
                     self.send_message(proto.ack(msg_endpoint, msg_id))
@@ -397,8 +735,15 @@ class Session(sessioncontainer.SessionBase):
                 if args is None:
                     args = []
 
+                if watched:
+                    collector.processing = (self.session_id, msg_endpoint, event['name'])
+
                 ack_response = None
 
+                if profiling:
+                    profiler.add('parse', started)
+                    started = time.time()
+
                 # It is kind of magic - if there's only one parameter
                 # and it is dict, unpack dictionary. Otherwise, pass
                 # in args
@@ -410,6 +755,9 @@ class Session(sessioncontainer.SessionBase):
                 else:
                     ack_response = conn.on_event(event['name'], args=args)
 
+                if profiling:
+                    profiler.add('dispatch', started)
+
                 if msg_id:
                     if msg_id.endswith('+'):
                         msg_id = msg_id[:-1]
@@ -435,3 +783,6 @@ class Session(sessioncontainer.SessionBase):
             # TODO: Add global exception callback?
 
             raise
+        finally:
+            if watched:
+                collector.processing = None
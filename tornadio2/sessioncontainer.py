@@ -22,23 +22,69 @@
     support.
 """
 
+import re
 from heapq import heappush, heappop
 from time import time
-from hashlib import md5
-from random import random
+from os import urandom
+from binascii import hexlify
+
+
+class SessionIdGenerator(object):
+    """Session id generator.
+
+    Reads OS randomness in batches and hex-encodes whole batch at once, so
+    generating new session id is just a string slice. Optional prefix can be
+    used to embed worker or shard identifier into session ids.
+    """
+    _valid_prefix = re.compile(r'^[A-Za-z0-9_.-]*$')
+
+    def __init__(self, prefix='', key_size=16, batch_size=256):
+        """Constructor.
+
+        `prefix`
+            Optional session id prefix. Can contain letters, digits, '_', '.'
+            and '-'.
+        `key_size`
+            Number of random bytes in session id
+        `batch_size`
+            Number of session ids to read from the OS at once
+        """
+        if not self._valid_prefix.match(prefix):
+            raise ValueError('Invalid session id prefix: %r' % prefix)
+
+        self.prefix = prefix
+
+        self._key_len = key_size * 2
+        self._batch_bytes = key_size * batch_size
+
+        self._buffer = ''
+        self._offset = 0
+
+    def generate(self):
+        """Return new session id"""
+        offset = self._offset
+        if offset >= len(self._buffer):
+            self._buffer = hexlify(urandom(self._batch_bytes))
+            offset = 0
+
+        self._offset = offset + self._key_len
+
+        return self.prefix + self._buffer[offset:self._offset]
+
+
+_generator = SessionIdGenerator()
 
 
 def _random_key():
     """Return random session key"""
-    i = md5()
-    i.update('%s%s' % (random(), time()))
-    return i.hexdigest()
+    return _generator.generate()
 
 
 class SessionBase(object):
     """Represents one session object stored in the session container.
     Derive from this object to store additional data.
     """
+    __slots__ = ('session_id', 'promoted', 'expiry', 'expiry_date')
 
     def __init__(self, session_id=None, expiry=None):
         """Constructor.
@@ -80,7 +126,57 @@ class SessionBase(object):
                              self.promoted or 0)
 
 
-class SessionContainer(object):
+class SessionStore(object):
+    """Session store interface, used by the router.
+
+    Live session objects always stay in the process which created them, so
+    stores keep them in a local container. Stores which are shared between
+    processes additionally track which process owns each session id.
+
+    Third-party stores should implement all methods below. ``touch`` is
+    called every time transport attaches to the session, so it should not
+    do any blocking I/O: queue the update and write it later, for example
+    from ``expire``, which is called by the router every
+    `session_check_interval` seconds.
+    """
+    # Owner id of the sessions created by this process
+    owner_id = 'local'
+
+    def add(self, session):
+        """Add session to the store"""
+        raise NotImplementedError()
+
+    def get(self, session_id):
+        """Return local session object or None if it is not available"""
+        raise NotImplementedError()
+
+    def remove(self, session_id):
+        """Remove session from the store. Returns True if session was found"""
+        raise NotImplementedError()
+
+    def touch(self, session):
+        """Mark session as used"""
+        pass
+
+    def expire(self, current_time=None):
+        """Expire old sessions"""
+        raise NotImplementedError()
+
+    def owner(self, session_id):
+        """Return owner id of the session or None if session is not known"""
+        if self.get(session_id) is not None:
+            return self.owner_id
+        return None
+
+    def values(self):
+        """Return list of all local sessions"""
+        raise NotImplementedError()
+
+    def __len__(self):
+        raise NotImplementedError()
+
+
+class SessionContainer(SessionStore):
     def __init__(self):
         self._items = dict()
         self._queue = []
@@ -96,6 +192,13 @@ class SessionContainer(object):
         if session.expiry is not None:
             heappush(self._queue, session)
 
+    def __len__(self):
+        return len(self._items)
+
+    def values(self):
+        """Return list of all sessions"""
+        return self._items.values()
+
     def get(self, session_id):
         """Return session object or None if it is not available
 
@@ -163,3 +266,77 @@ class SessionContainer(object):
                 heappush(self._queue, top)
             else:
                 del self._items[top.session_id]
+
+
+class ShardedSessionContainer(SessionStore):
+    """Session container split into independent shards by session id hash.
+
+    Each ``expire()`` call sweeps only one shard, shards are swept in
+    round-robin order. Call ``expire()`` `shards` times more often than you
+    would call it for the ``SessionContainer``.
+    """
+    def __init__(self, shards=8):
+        """Constructor.
+
+        `shards`
+            Number of shards
+        """
+        self.shards = [SessionContainer() for _ in xrange(shards)]
+        self._next_shard = 0
+
+    def _shard(self, session_id):
+        return self.shards[hash(session_id) % len(self.shards)]
+
+    def add(self, session):
+        """Add session to the container.
+
+        `session`
+            Session object
+        """
+        self._shard(session.session_id).add(session)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def values(self):
+        """Return list of all sessions"""
+        result = []
+        for shard in self.shards:
+            result.extend(shard.values())
+        return result
+
+    def get(self, session_id):
+        """Return session object or None if it is not available
+
+        `session_id`
+            Session identifier
+        """
+        return self._shard(session_id).get(session_id)
+
+    def remove(self, session_id):
+        """Remove session object from the container
+
+        `session_id`
+            Session identifier
+        """
+        return self._shard(session_id).remove(session_id)
+
+    def expire(self, current_time=None):
+        """Expire old entries of the next shard
+
+        `current_time`
+            Optional time to be used to clean up queue (can be used in unit tests)
+        """
+        shard = self.shards[self._next_shard]
+        self._next_shard = (self._next_shard + 1) % len(self.shards)
+
+        shard.expire(current_time)
+
+    def expire_all(self, current_time=None):
+        """Expire old entries of all shards
+
+        `current_time`
+            Optional time to be used to clean up queue (can be used in unit tests)
+        """
+        for shard in self.shards:
+            shard.expire(current_time)
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+    tornadio2.snapshot
+    ~~~~~~~~~~~~~~~~~~
+
+    Session snapshots. Used to preserve sessions and their queued messages
+    between server restarts, so polling clients can transparently resume.
+"""
+from __future__ import with_statement
+
+import os
+import time
+import logging
+import Cookie
+
+from tornado.web import HTTPError
+
+from tornadio2 import proto
+
+
+logger = logging.getLogger('tornadio2.snapshot')
+
+
+SNAPSHOT_VERSION = 2
+
+
+class JSONSerializer(object):
+    """Default snapshot serializer.
+
+    Custom serializers should implement same ``dumps`` and ``loads`` methods.
+    """
+    def dumps(self, data):
+        return proto.json_dumps(data)
+
+    def loads(self, data):
+        return proto.json_load(data)
+
+
+class SnapshotRequest(object):
+    """Request-like object, used to recreate ``ConnectionInfo`` of the
+    restored session.
+    """
+    def __init__(self, remote_ip, arguments, cookies):
+        self.remote_ip = remote_ip
+        self.arguments = arguments
+
+        self.cookies = Cookie.SimpleCookie()
+        for name, value in cookies.iteritems():
+            self.cookies[str(name)] = value
+
+
+def _remaining(session, now):
+    """Return number of seconds left till session expiration or None if
+    session never expires.
+    """
+    if session.expiry is None:
+        return None
+
+    # Session with attached transport is alive, it is just not promoted yet
+    if session.handler is not None:
+        return session.expiry
+
+    deadline = session.expiry_date
+    if session.promoted is not None and session.promoted > deadline:
+        deadline = session.promoted
+
+    return deadline - now
+
+
+def dump_session(session, now=None):
+    """Return serializable session record.
+
+    `session`
+        Session object
+    `now`
+        Optional current time (can be used in unit tests)
+    """
+    info = session.info
+
+    if now is None:
+        now = time.time()
+
+    return dict(
+        id=session.session_id,
+        ip=session.remote_ip,
+        arguments=info.arguments,
+        cookies=dict((name, getattr(morsel, 'value', morsel))
+                     for name, morsel in info.cookies.iteritems()),
+        queue=session.get_pending(),
+        state=session.conn.get_state(),
+        expires=_remaining(session, now)
+        )
+
+
+def save(router, path, serializer=None):
+    """Save open sessions to the file. Returns number of saved sessions.
+
+    Only default endpoint connection state is preserved, multiplexed endpoint
+    connections are not saved.
+
+    `router`
+        ``TornadioRouter`` instance
+    `path`
+        Snapshot file name
+    `serializer`
+        Optional serializer. Defaults to ``JSONSerializer``.
+    """
+    serializer = serializer or JSONSerializer()
+
+    now = time.time()
+
+    sessions = []
+    for s in router._sessions.values():
+        if s.is_closed:
+            continue
+
+        try:
+            sessions.append(dump_session(s, now))
+        except Exception:
+            logger.error('Failed to save session %s' % s.session_id,
+                         exc_info=True)
+
+    data = serializer.dumps(dict(version=SNAPSHOT_VERSION,
+                                 saved=now,
+                                 sessions=sessions))
+
+    # Write to temporary file first, so crash won't leave partial snapshot
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.rename(tmp_path, path)
+
+    logger.info('Saved %d sessions to %s' % (len(sessions), path))
+
+    return len(sessions)
+
+
+def restore(router, path, serializer=None):
+    """Restore sessions from the snapshot file. Returns number of restored
+    sessions.
+
+    Sessions, which expired while server was stopped, are skipped. Snapshot
+    file is removed after restore, so sessions are never restored twice.
+
+    `router`
+        ``TornadioRouter`` instance
+    `path`
+        Snapshot file name
+    `serializer`
+        Optional serializer. Defaults to ``JSONSerializer``.
+    """
+    serializer = serializer or JSONSerializer()
+
+    with open(path, 'rb') as f:
+        data = serializer.loads(f.read())
+
+    if data.get('version') != SNAPSHOT_VERSION:
+        logger.error('Unsupported snapshot version: %s' % data.get('version'))
+        return 0
+
+    # Time passed since the snapshot was saved
+    age = max(0, time.time() - data['saved'])
+
+    count = skipped = 0
+
+    for record in data['sessions']:
+        expires = record['expires']
+        if expires is not None:
+            expires -= age
+            if expires <= 0:
+                skipped += 1
+                continue
+
+        request = SnapshotRequest(record['ip'],
+                                  record['arguments'],
+                                  record['cookies'])
+
+        try:
+            router.restore_session(request,
+                                   str(record['id']),
+                                   record['state'],
+                                   record['queue'],
+                                   expires)
+            count += 1
+        except HTTPError:
+            # Connection refused to open
+            pass
+        except Exception:
+            logger.error('Failed to restore session %s' % record['id'],
+                         exc_info=True)
+
+    os.remove(path)
+
+    logger.info('Restored %d sessions from %s, %d expired' % (count, path, skipped))
+
+    return count
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+    tornadio2.sqlitestore
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Session store shared by multiple processes on one host.
+"""
+import os
+import socket
+import logging
+import sqlite3
+from heapq import heappush, heappop
+from time import time
+
+from tornadio2 import sessioncontainer
+
+
+logger = logging.getLogger('tornadio2.sqlitestore')
+
+
+class SQLiteSessionStore(sessioncontainer.SessionStore):
+    """Session store which records session ownership in the SQLite
+    database, so every process on the host can find out which process owns
+    the session.
+
+    Session objects are kept in the local container. Added, touched and
+    removed sessions are written in one transaction from ``expire`` (or
+    ``flush``), so requests never wait for the database. Rows are leased:
+    row of the session, which was not touched, is rewritten only when its
+    lease is about to end, and row of the expired session is deleted at
+    that time.
+    """
+    def __init__(self, path, owner_id=None, container=None, flush_interval=5,
+                 lease=60, timeout=0.05):
+        """Constructor.
+
+        `path`
+            Database file name
+        `owner_id`
+            Owner id of this process. Defaults to host name and process id.
+        `container`
+            Local session container. Defaults to ``SessionContainer``.
+        `flush_interval`
+            Minimal interval between database writes, in seconds
+        `lease`
+            Time, in seconds, session row stays valid without being
+            rewritten
+        `timeout`
+            Time, in seconds, to wait for the locked database. If database
+            is still locked, updates are written on the next flush.
+        """
+        self.owner_id = owner_id or '%s:%d' % (socket.gethostname(), os.getpid())
+        self.container = container or sessioncontainer.SessionContainer()
+        self.flush_interval = flush_interval
+        self.lease = lease
+
+        # Ids of the sessions to write and to delete on the next flush
+        self._dirty = set()
+        self._removed = set()
+
+        # Lease end of the written rows and queue of the lease ends
+        self._leases = dict()
+        self._renewals = []
+
+        self._last_flush = None
+        self._next_flush = 0
+
+        # Store is created on startup, so it can wait for the database
+        self._db = sqlite3.connect(path, timeout=10)
+        self._db.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                         'id TEXT PRIMARY KEY, '
+                         'owner TEXT NOT NULL, '
+                         'expires REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS sessions_expires '
+                         'ON sessions (expires)')
+        self._db.commit()
+
+        # But flushes run on the IOLoop
+        self._db.execute('PRAGMA busy_timeout = %d' % int(timeout * 1000))
+
+    def add(self, session):
+        """Add session to the store"""
+        self.container.add(session)
+
+        self._dirty.add(session.session_id)
+        self._removed.discard(session.session_id)
+
+    def get(self, session_id):
+        """Return local session object or None if it is not available"""
+        return self.container.get(session_id)
+
+    def remove(self, session_id):
+        """Remove session from the store. Returns True if session was found"""
+        if not self.container.remove(session_id):
+            return False
+
+        self._dirty.discard(session_id)
+        self._removed.add(session_id)
+        return True
+
+    def touch(self, session):
+        """Queue update of the session row"""
+        self._dirty.add(session.session_id)
+
+    def expire(self, current_time=None):
+        """Expire local sessions and write queued updates"""
+        self.container.expire(current_time)
+
+        now = current_time if current_time is not None else time()
+        if now >= self._next_flush:
+            self.flush(now)
+
+    def flush(self, now=None):
+        """Write rows of the added and touched sessions, renew leases which
+        are about to end, delete rows of the removed sessions and remove
+        expired rows.
+
+        `now`
+            Optional current time (can be used in unit tests)
+        """
+        if now is None:
+            now = time()
+
+        # Rows should stay valid until the next flush, even if it is late
+        period = self.flush_interval
+        if self._last_flush is not None:
+            period = max(period, now - self._last_flush)
+
+        self._last_flush = now
+        self._next_flush = now + self.flush_interval
+
+        container = self.container
+        dirty = self._dirty
+        removed = self._removed
+        leases = self._leases
+        renewals = self._renewals
+
+        # Leases that end before the next flush
+        renew_before = now + 2 * period
+        while renewals and renewals[0][0] < renew_before:
+            expires, session_id = heappop(renewals)
+
+            # Row was rewritten or deleted since then
+            if leases.get(session_id) != expires:
+                continue
+
+            if container.get(session_id) is not None:
+                dirty.add(session_id)
+            else:
+                removed.add(session_id)
+
+        expires = now + self.lease + 2 * period
+
+        written = []
+        for session_id in dirty:
+            if container.get(session_id) is not None:
+                written.append(session_id)
+            elif session_id in leases:
+                removed.add(session_id)
+
+        try:
+            self._db.executemany('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)',
+                                 [(session_id, self.owner_id, expires)
+                                  for session_id in written])
+            self._db.executemany('DELETE FROM sessions WHERE id = ? AND owner = ?',
+                                 [(session_id, self.owner_id)
+                                  for session_id in removed])
+            self._db.execute('DELETE FROM sessions WHERE expires < ?', (now,))
+            self._db.commit()
+        except sqlite3.Error:
+            # Queued updates are kept and written on the next flush
+            logger.warning('Failed to update session store', exc_info=True)
+            self._db.rollback()
+            return
+
+        for session_id in written:
+            leases[session_id] = expires
+            heappush(renewals, (expires, session_id))
+
+        for session_id in removed:
+            leases.pop(session_id, None)
+
+        self._dirty = set()
+        self._removed = set()
+
+    def owner(self, session_id, now=None):
+        """Return owner id of the session or None if session is not known
+
+        `session_id`
+            Session id
+        `now`
+            Optional current time (can be used in unit tests)
+        """
+        if self.container.get(session_id) is not None:
+            return self.owner_id
+
+        if now is None:
+            now = time()
+
+        try:
+            row = self._db.execute('SELECT owner FROM sessions WHERE id = ? AND expires >= ?',
+                                   (session_id, now)).fetchone()
+        except sqlite3.Error:
+            logger.warning('Failed to read session store', exc_info=True)
+            return None
+
+        if row is not None:
+            return row[0]
+
+        return None
+
+    def values(self):
+        """Return list of all local sessions"""
+        return self.container.values()
+
+    def __len__(self):
+        return len(self.container)
+
+    def close(self):
+        """Remove sessions of this process from the database and close it"""
+        self._dirty = set()
+        self._removed = set()
+        self._leases = dict()
+        self._renewals = []
+
+        self._db.execute('DELETE FROM sessions WHERE owner = ?', (self.owner_id,))
+        self._db.commit()
+        self._db.close()
@@ -20,12 +20,20 @@
 
     Statistics module
 """
+import sys
+import time
+import logging
+import threading
+import traceback
 from datetime import datetime
 from collections import deque
 
 from tornado import ioloop
 
 
+logger = logging.getLogger('tornadio2.stats')
+
+
 class MovingAverage(object):
     """Moving average class implementation"""
     def __init__(self, period=10):
@@ -73,12 +81,207 @@ class MovingAverage(object):
             self.last_average = self.sum / float(streamlen)
 
 
+class LoopWatchdog(object):
+    """IOLoop lag monitor and blocking callback detector.
+
+    Schedules a timeout every `interval` milliseconds and measures how late
+    it was executed by the IOLoop. Background thread checks if the loop did
+    not respond for more than `threshold` milliseconds and, if it did, captures
+    the IOLoop thread stack along with the packet that was being processed by
+    ``Session.raw_message()``.
+    """
+    def __init__(self, stats, interval=500, threshold=1000, max_incidents=20):
+        """Constructor.
+
+        `stats`
+            ``StatsCollector`` instance, used to get currently processed packet
+        `interval`
+            Lag measurement interval, in milliseconds
+        `threshold`
+            Blocking threshold, in milliseconds
+        `max_incidents`
+            Number of recent incidents to keep
+        """
+        self.stats = stats
+        self.interval = interval / 1000.0
+        self.threshold = threshold / 1000.0
+
+        # Lag, in milliseconds
+        self.lag = MovingAverage()
+        self.max_lag = 0
+
+        # Blocking callbacks
+        self.blocked_callbacks = 0
+        self.incidents = deque(maxlen=max_incidents)
+
+        self.io_loop = None
+
+        self._running = False
+        self._thread = None
+        self._loop_thread_id = None
+        self._deadline = None
+        self._last_tick = None
+        self._incident = None
+
+    def start(self, io_loop):
+        """Start watchdog.
+
+        `io_loop`
+            IOLoop instance to watch
+        """
+        self.io_loop = io_loop
+        self._running = True
+
+        self._last_tick = time.time()
+        self._schedule(self._last_tick)
+
+        self._thread = threading.Thread(target=self._watch,
+                                        name='tornadio2-watchdog')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop watchdog"""
+        self._running = False
+
+    def _schedule(self, now):
+        self._deadline = now + self.interval
+        self.io_loop.add_timeout(self._deadline, self._tick)
+
+    def _tick(self, now=None):
+        """IOLoop side of the watchdog"""
+        if not self._running:
+            return
+
+        if now is None:
+            now = time.time()
+
+        if self._loop_thread_id is None:
+            self._loop_thread_id = threading.current_thread().ident
+
+        lag = max(0, now - self._deadline) * 1000.0
+
+        self.lag.add(lag)
+        self.lag.flush()
+
+        if lag > self.max_lag:
+            self.max_lag = lag
+
+        # Blocking callback finished, record how long it took
+        incident = self._incident
+        if incident is not None:
+            incident['duration'] = (now - self._last_tick - self.interval) * 1000.0
+            self._incident = None
+
+        self._last_tick = now
+        self._schedule(now)
+
+    def _watch(self):
+        """Watchdog thread"""
+        while self._running:
+            time.sleep(self.threshold / 2)
+            self._check()
+
+    def _check(self, now=None):
+        """Check if IOLoop is blocked. Returns incident information if
+        blocking callback was detected.
+        """
+        if now is None:
+            now = time.time()
+
+        last_tick = self._last_tick
+        if last_tick is None or self._incident is not None:
+            return None
+
+        blocked = (now - last_tick - self.interval) * 1000.0
+        if blocked < self.threshold * 1000.0:
+            return None
+
+        stack = None
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is not None:
+            stack = ''.join(traceback.format_stack(frame))
+
+        session_id, endpoint, event = self.stats.processing or (None, None, None)
+
+        incident = dict(time=datetime.now(),
+                        duration=blocked,
+                        session_id=session_id,
+                        endpoint=endpoint,
+                        event=event,
+                        stack=stack)
+
+        self._incident = incident
+        self.incidents.append(incident)
+        self.blocked_callbacks += 1
+
+        logger.warning('IOLoop is blocked for %dms (session: %s, endpoint: %s, event: %s)\n%s' % (
+                       blocked, session_id, endpoint, event, stack or ''))
+
+        return incident
+
+
+class StageProfiler(object):
+    """Message pipeline profiler.
+
+    Collects number of calls and cumulative time spent in every stage of the
+    message pipeline. Instrumentation points check `enabled` flag before
+    doing anything, so disabled profiler costs one attribute lookup per stage.
+
+    Stages are inclusive: for example, `dispatch` also includes time spent
+    encoding and writing messages sent by the event handler.
+    """
+    STAGES = ('handshake', 'parse', 'dispatch', 'encode', 'write')
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = None
+
+        self.reset()
+
+    def reset(self):
+        """Reset collected timings"""
+        self.stages = dict((name, [0, 0.0]) for name in self.STAGES)
+
+    def add(self, stage, started):
+        """Add timing for the stage.
+
+        `stage`
+            Stage name
+        `started`
+            Time when stage was started
+        """
+        data = self.stages[stage]
+        data[0] += 1
+        data[1] += time.time() - started
+
+    def dump(self):
+        """Return per-stage breakdown. Times are in milliseconds."""
+        result = dict()
+
+        for name, (calls, total) in self.stages.iteritems():
+            result[name] = dict(calls=calls,
+                                total=total * 1000.0,
+                                average=total * 1000.0 / calls if calls else 0)
+
+        return result
+
+
 class StatsCollector(object):
     """Statistics collector"""
     def __init__(self):
         self.periodic_callback = None
         self.start_time = datetime.now()
 
+        # Packet being processed by the session: (session_id, endpoint, event)
+        self.processing = None
+
+        # Event loop watchdog
+        self.watchdog = None
+
+        # Message pipeline profiler
+        self.profiler = StageProfiler()
+
         # Sessions
         self.max_sessions = 0
         self.active_sessions = 0
@@ -88,9 +291,16 @@ class StatsCollector(object):
         self.active_connections = 0
         self.connections_ps = MovingAverage()
 
+        # Handshakes
+        self.handshakes_ps = MovingAverage()
+        self.handshakes_rejected = 0
+
         # Packets
         self.packets_sent_ps = MovingAverage()
         self.packets_recv_ps = MovingAverage()
+        self.inbound_limited = 0
+        self.packets_coalesced = 0
+        self.events_rejected = 0
 
     # Sessions
     def session_opened(self):
@@ -114,6 +324,13 @@ class StatsCollector(object):
     def connection_closed(self):
         self.active_connections -= 1
 
+    # Handshakes
+    def on_handshake(self):
+        self.handshakes_ps.add(1)
+
+    def on_handshake_rejected(self):
+        self.handshakes_rejected += 1
+
     # Packets
     def on_packet_sent(self, num):
         self.packets_sent_ps.add(num)
@@ -121,6 +338,15 @@ class StatsCollector(object):
     def on_packet_recv(self, num):
         self.packets_recv_ps.add(num)
 
+    def on_inbound_limited(self):
+        self.inbound_limited += 1
+
+    def on_packet_coalesced(self):
+        self.packets_coalesced += 1
+
+    def on_event_rejected(self):
+        self.events_rejected += 1
+
     def dump(self):
         """Return current statistics"""
         return dict(
@@ -133,17 +359,43 @@ class StatsCollector(object):
                 max_connections=self.max_connections,
                 connections_ps=self.connections_ps.last_average,
 
+                # Handshakes
+                handshakes_ps=self.handshakes_ps.last_average,
+                handshakes_rejected=self.handshakes_rejected,
+
                 # Packets
                 packets_sent_ps=self.packets_sent_ps.last_average,
-                packets_recv_ps=self.packets_recv_ps.last_average
+                packets_recv_ps=self.packets_recv_ps.last_average,
+                inbound_limited=self.inbound_limited,
+                packets_coalesced=self.packets_coalesced,
+                events_rejected=self.events_rejected,
+
+                # Event loop
+                loop_lag=self.watchdog.lag.last_average if self.watchdog else 0,
+                max_loop_lag=self.watchdog.max_lag if self.watchdog else 0,
+                blocked_callbacks=self.watchdog.blocked_callbacks if self.watchdog else 0
                 )
 
     def _update_averages(self):
         self.packets_sent_ps.flush()
         self.packets_recv_ps.flush()
         self.connections_ps.flush()
+        self.handshakes_ps.flush()
 
     def start(self, io_loop):
         # If started, will collect averages every second
         self.periodic_callback = ioloop.PeriodicCallback(self._update_averages, 1000, io_loop)
         self.periodic_callback.start()
+
+    def start_watchdog(self, io_loop, interval=500, threshold=1000):
+        """Start event loop watchdog.
+
+        `io_loop`
+            IOLoop instance
+        `interval`
+            Lag measurement interval, in milliseconds
+        `threshold`
+            Blocking callback threshold, in milliseconds
+        """
+        self.watchdog = LoopWatchdog(self, interval, threshold)
+        self.watchdog.start(io_loop)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright: (c) 2011 by the Serge S. Koval, see AUTHORS for more details.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+    tornadio2.trace
+    ~~~~~~~~~~~~~~~
+
+    Packet tracing.
+"""
+import logging
+
+
+logger = logging.getLogger('tornadio2.trace')
+
+
+# Packet directions
+INBOUND = '>>>'
+OUTBOUND = '<<<'
+
+
+class PacketTracer(object):
+    """Passes sent and received packets to the sink.
+
+    Router keeps tracer in the `tracer` attribute, which is None when
+    tracing is disabled, so disabled tracing costs one attribute lookup per
+    packet.
+    """
+    def __init__(self, sample=1, sessions=None, sink=None):
+        """Constructor.
+
+        `sample`
+            Trace only every `sample`-th packet
+        `sessions`
+            Optional list of session ids to trace. If not set, packets of all
+            sessions are traced.
+        `sink`
+            Callable which accepts session, direction, packet and transport
+            name. By default, packets are logged with DEBUG level.
+        """
+        self.sample = max(1, sample)
+        self.sessions = frozenset(sessions) if sessions else None
+        self.sink = sink or self.log
+
+        self._counter = 0
+
+    def trace(self, session, direction, packet, transport=None):
+        """Trace packet.
+
+        `session`
+            Session object
+        `direction`
+            ``INBOUND`` or ``OUTBOUND``
+        `packet`
+            Encoded socket.io packet
+        `transport`
+            Name of the transport which received the packet. If not set,
+            last transport attached to the session is used.
+        """
+        if self.sessions is not None and session.session_id not in self.sessions:
+            return
+
+        if self.sample > 1:
+            self._counter += 1
+            if self._counter % self.sample:
+                return
+
+        if transport is None:
+            transport = session._transport or ''
+
+        self.sink(session, direction, packet, transport)
+
+    def log(self, session, direction, packet, transport):
+        """Default sink, logs packet"""
+        logger.debug('%s %s %s %s', session.session_id, transport, direction, packet)